@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic Copilot chat export for benchmarking.
+
+The output mimics the structure of a VS Code "Chat: Export Chat" file: agent
+requests with tool-call rounds, read_file results, text edits, progress tasks
+and the usual internal metadata, pretty-printed with two-space indentation.
+Lone UTF-16 surrogates are written as JSON escapes, as VS Code does.
+
+Usage: python benchmarks/generate_export.py out.json --target-mb 100
+"""
+
+import argparse
+import json
+import random
+import re
+
+WORDS = (
+    "the repo organizer should group starred repositories by topic and language "
+    "use flask routes with sqlite storage and a small jquery front end deploy to "
+    "fly io keep the prd short and list the success metrics for each milestone"
+).split()
+
+EXTENSIONS = ['.md', '.py', '.js', '.json', '.yaml', '.html', '.css', '.sh', '.txt']
+
+LONE_SURROGATES = ['\udeaa', '\udead', '\ud83d', '\udc00']
+
+_SURROGATE = re.compile('[\ud800-\udfff]')
+
+
+def _sentence(rng: random.Random, words: int, surrogate_rate: float) -> str:
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    if surrogate_rate and rng.random() < surrogate_rate:
+        position = rng.randrange(len(text) + 1)
+        text = text[:position] + rng.choice(LONE_SURROGATES) + text[position:]
+    return text
+
+
+def _paragraphs(rng: random.Random, count: int, surrogate_rate: float) -> str:
+    lines = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.15:
+            lines.append(f"## {_sentence(rng, 4, 0).title()}")
+        elif kind < 0.35:
+            lines.extend(f"- **{rng.choice(WORDS)}**: {_sentence(rng, 8, surrogate_rate)}" for _ in range(rng.randint(2, 5)))
+        elif kind < 0.45:
+            lines.extend(f"✅ {_sentence(rng, 5, 0)}" for _ in range(rng.randint(2, 4)))
+        elif kind < 0.55:
+            lines.append("```python")
+            lines.extend(f"def {rng.choice(WORDS)}_{i}():\n    return {i}" for i in range(rng.randint(1, 4)))
+            lines.append("```")
+        else:
+            lines.append(_sentence(rng, rng.randint(10, 40), surrogate_rate))
+        lines.append("")
+    return '\n'.join(lines)
+
+
+def _file_lines(rng: random.Random, count: int) -> str:
+    return ''.join(f"{_sentence(rng, rng.randint(3, 12), 0)}\n" for _ in range(count))
+
+
+def _tool_result(path: str, text: str, extension: str) -> dict:
+    """Build a toolCallResults entry with the nested node structure VS Code uses."""
+    language = extension.lstrip('.')
+    children = [{
+        "type": 1, "ctor": 2, "ctorName": "Lee",
+        "children": [{"type": 2, "priority": 82, "text": f"```{language}\n", "references": [{
+            "anchor": {"$mid": 1, "fsPath": path, "external": f"file://{path}", "path": path, "scheme": "file"},
+            "options": {"isFromTool": True},
+        }], "lineBreakBefore": True}],
+        "props": {"priority": 82}, "references": [],
+    }]
+    for priority, line in enumerate(text.splitlines(keepends=True)):
+        children.append({
+            "type": 1, "ctor": 2, "ctorName": "Lee",
+            "children": [{"type": 2, "priority": 81 - priority, "text": line, "references": [], "lineBreakBefore": True}],
+            "props": {"priority": 81 - priority}, "references": [],
+        })
+    children.append({"type": 2, "priority": 0, "text": "```", "references": [], "lineBreakBefore": True})
+    return {"$mid": 20, "content": [{"$mid": 22, "value": {"node": {
+        "type": 1, "ctor": 2, "ctorName": "zj", "children": children, "props": {}, "references": [],
+    }}}]}
+
+
+def generate_request(rng: random.Random, index: int, rounds: int, reads: int, edits: int,
+                     file_lines: int, surrogate_rate: float) -> dict:
+    """Generate one agent-mode request."""
+    root = f"/Users/dev/project{index % 7}"
+    response = [{"kind": "progressTaskSerialized", "content": {"value": "Optimizing tool selection...", "uris": {}}, "progress": []}]
+    tool_call_rounds = []
+    tool_call_results = {}
+    call_number = 0
+
+    for round_index in range(rounds):
+        round_text = _sentence(rng, rng.randint(10, 30), surrogate_rate)
+        response.append({"value": round_text, "supportThemeIcons": False, "supportHtml": False,
+                         "baseUri": {"$mid": 1, "path": f"{root}/", "scheme": "file"}})
+        tool_calls = []
+        for _ in range(reads // rounds + (1 if round_index < reads % rounds else 0)):
+            extension = rng.choice(EXTENSIONS)
+            path = f"{root}/src/{rng.choice(WORDS)}_{rng.randint(0, 40)}{extension}"
+            call_id = f"toolu_{index:06d}{call_number:04d}__vscode-{1757719443079 + call_number}"
+            call_number += 1
+            end_line = rng.randint(20, 200)
+            tool_calls.append({"name": "read_file", "id": call_id, "arguments": json.dumps(
+                {"filePath": path, "startLine": 1, "endLine": end_line})})
+            tool_call_results[call_id] = _tool_result(path, _file_lines(rng, file_lines), extension)
+            uri = f"file://{path}"
+            response.append({"kind": "prepareToolInvocation", "toolName": "copilot_readFile"})
+            response.append({
+                "kind": "toolInvocationSerialized",
+                "invocationMessage": {"value": f"Reading [](file://{path}#1-{end_line}), lines 1 to {end_line}",
+                                      "supportThemeIcons": False, "supportHtml": False,
+                                      "uris": {uri: {"$mid": 1, "path": path, "scheme": "file"}}},
+                "pastTenseMessage": {"value": f"Read [](file://{path}#1-{end_line}), lines 1 to {end_line}",
+                                     "supportThemeIcons": False, "supportHtml": False},
+                "isConfirmed": True, "isComplete": True, "toolCallId": call_id, "toolId": "copilot_readFile",
+            })
+        tool_call_rounds.append({"response": round_text, "toolCalls": tool_calls, "toolInputRetry": 0,
+                                 "id": f"round-{index}-{round_index}"})
+
+    if edits:
+        path = f"{root}/src/{rng.choice(WORDS)}{rng.choice(EXTENSIONS)}"
+        edit_groups = []
+        line = 1
+        for _ in range(edits):
+            line += rng.randint(0, 6)
+            length = rng.randint(0, 3)
+            edit_groups.append([{"text": _file_lines(rng, length + 1),
+                                 "range": {"startLineNumber": line, "startColumn": 1,
+                                           "endLineNumber": line + length, "endColumn": 1}}])
+            line += length
+        edit_groups.append([])
+        response.append({"kind": "textEditGroup", "uri": {"$mid": 1, "fsPath": path, "external": f"file://{path}",
+                                                          "path": path, "scheme": "file"},
+                         "edits": edit_groups, "done": True})
+        response.append({"kind": "undoStop", "id": f"undo-{index}"})
+        response.append({"kind": "codeblockUri", "uri": {"$mid": 1, "path": path, "scheme": "file"}})
+
+    response.append({"value": _paragraphs(rng, rng.randint(2, 8), surrogate_rate), "supportThemeIcons": False,
+                     "supportHtml": False})
+    response.append({"kind": "inlineReference", "inlineReference": {"$mid": 1, "path": f"{root}/README.md", "scheme": "file"}})
+
+    message = _sentence(rng, rng.randint(5, 60), surrogate_rate)
+    return {
+        "requestId": f"request_{index:08d}",
+        "message": {"text": message, "parts": [{"kind": "text", "text": message,
+                                                "range": {"start": 0, "endExclusive": len(message)}}]},
+        "variableData": {"variables": [{
+            "id": f"vscode.prompt.instructions.root__file://{root}/.github/copilot-instructions.md",
+            "name": "prompt:copilot-instructions.md",
+            "value": {"$mid": 1, "path": f"{root}/.github/copilot-instructions.md", "scheme": "file"},
+            "kind": "promptFile",
+            "originLabel": "Automatically attached as setting github.copilot.chat.codeGeneration.useInstructionFiles is enabled",
+            "automaticallyAdded": True,
+        }]},
+        "response": response,
+        "responseId": f"response_{index:08d}",
+        "result": {
+            "timings": {"firstProgress": rng.randint(500, 20000), "totalElapsed": rng.randint(1000, 300000)},
+            "metadata": {
+                "codeBlocks": [],
+                "renderedUserMessage": [{"type": 1, "text": message}],
+                "toolCallRounds": tool_call_rounds,
+                "toolCallResults": tool_call_results,
+                "modelMessageId": f"model-{index}",
+                "responseId": f"response_{index:08d}",
+                "sessionId": "synthetic-session",
+                "agentId": "github.copilot.editsAgent",
+            },
+            "details": "Claude Sonnet 4 • 1x",
+        },
+        "followups": [],
+        "isCanceled": False,
+        "contentReferences": [],
+        "codeCitations": [],
+        "timestamp": 1757720474534 + index * 60000,
+        "modelId": "copilot/claude-sonnet-4",
+    }
+
+
+def _dump(value, indent: int) -> str:
+    """Dump JSON like VS Code does: indented, non-ASCII kept, lone surrogates escaped."""
+    text = json.dumps(value, indent=2, ensure_ascii=False)
+    text = _SURROGATE.sub(lambda match: '\\u%04x' % ord(match.group()), text)
+    return text.replace('\n', '\n' + ' ' * indent)
+
+
+def generate_export(path: str, requests: int = 100, rounds: int = 3, reads: int = 6, edits: int = 12,
+                    file_lines: int = 80, surrogate_rate: float = 0.01, target_mb: float = None,
+                    seed: int = 0) -> int:
+    """Write a synthetic export to `path` and return the number of requests written.
+
+    With `target_mb`, requests are added until the file reaches that size and
+    `requests` is ignored. Requests are written one at a time, so generating a
+    very large export needs little memory.
+    """
+    rng = random.Random(seed)
+    rounds = max(1, rounds)
+    target_bytes = target_mb * 1024 * 1024 if target_mb else None
+    header = {
+        "requesterUsername": "synthetic-user",
+        "requesterAvatarIconUri": {"$mid": 1, "path": "/u/1", "scheme": "https", "authority": "avatars.githubusercontent.com"},
+        "responderUsername": "GitHub Copilot",
+        "responderAvatarIconUri": {"id": "copilot"},
+        "initialLocation": "panel",
+    }
+
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{\n')
+        for key, value in header.items():
+            f.write(f'  {json.dumps(key)}: {_dump(value, 2)},\n')
+        f.write('  "requests": [')
+        while (written < requests) if target_bytes is None else (f.tell() < target_bytes):
+            request = generate_request(rng, written, rounds, reads, edits, file_lines, surrogate_rate)
+            f.write((',\n    ' if written else '\n    ') + _dump(request, 4))
+            written += 1
+        f.write('\n  ]\n}' if written else ']\n}')
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Copilot chat export for benchmarking")
+    parser.add_argument('output_file', help='Output JSON file')
+    parser.add_argument('--requests', type=int, default=100, help='Number of requests (default: 100)')
+    parser.add_argument('--target-mb', type=float, help='Keep adding requests until the file reaches this size')
+    parser.add_argument('--rounds', type=int, default=3, help='Tool-call rounds per request (default: 3)')
+    parser.add_argument('--reads', type=int, default=6, help='read_file calls with results per request (default: 6)')
+    parser.add_argument('--edits', type=int, default=12, help='Text edits per request (default: 12)')
+    parser.add_argument('--file-lines', type=int, default=80, help='Lines per read_file result (default: 80)')
+    parser.add_argument('--surrogate-rate', type=float, default=0.01, help='Chance of a lone surrogate per sentence (default: 0.01)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    args = parser.parse_args()
+
+    count = generate_export(args.output_file, args.requests, args.rounds, args.reads, args.edits,
+                            args.file_lines, args.surrogate_rate, args.target_mb, args.seed)
+    print(f"Wrote {count} requests to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark the converter stage by stage on real or synthetic chat exports.
+
+For every input the harness times each stage (best of --repeat runs) and then
+runs it once more under tracemalloc to record its peak memory. Throughput is
+reported relative to the size of the input file.
+
+Usage: python benchmarks/run_benchmarks.py --sizes 10,100
+       python benchmarks/run_benchmarks.py samples/chat.json --json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_to_markdown as ctm  # noqa: E402
+from generate_export import generate_export  # noqa: E402
+
+
+def _response_parts(chat_data):
+    """Yield (typed part, tool index) for every tool invocation and edit group."""
+    for request in chat_data.get('requests', []):
+        metadata = (request.get('result') or {}).get('metadata') or {}
+        index = ctm.ToolCallIndex(metadata.get('toolCallResults', {}), metadata.get('toolCallRounds', []))
+        for part in ctm.extract_response_parts(request.get('response', [])):
+            if isinstance(part, (ctm.ToolInvocationPart, ctm.TextEditGroupPart)):
+                yield part, index
+
+
+def build_stages(input_file, output_file):
+    """Return (name, setup, run) triples; setup's result is passed to run."""
+    def read_bytes():
+        with open(input_file, 'rb') as f:
+            return f.read()
+
+    def decoded():
+        return ctm.read_chat_file(input_file)
+
+    def edit_groups():
+        return [part.data for part, _ in _response_parts(decoded()) if isinstance(part, ctm.TextEditGroupPart)]
+
+    def invocations():
+        return [(part.data, index) for part, index in _response_parts(decoded()) if isinstance(part, ctm.ToolInvocationPart)]
+
+    def write_chunks(chat_data):
+        with open(output_file, 'w', encoding='utf-8', errors='replace') as out:
+            ctm.write_markdown(ctm.iter_chat_markdown(chat_data), out)
+
+    return [
+        ('read', lambda: None, lambda _: read_bytes()),
+        ('decode_chat_bytes', read_bytes, ctm.decode_chat_bytes),
+        ('decode_chat_json', lambda: ctm.decode_chat_bytes(read_bytes()), ctm.decode_chat_json),
+        ('parse_chat_log', decoded, ctm.parse_chat_log),
+        ('format_text_edit_group', edit_groups, lambda groups: [ctm.format_text_edit_group(g) for g in groups]),
+        ('format_tool_invocation_details', invocations,
+         lambda calls: [ctm.format_tool_invocation_details(data, tool_index=index) for data, index in calls]),
+        ('write', decoded, write_chunks),
+        ('convert_file', lambda: None, lambda _: ctm.convert_file(input_file, output_file)),
+        ('convert_file --stream', lambda: None, lambda _: ctm.convert_file(input_file, output_file, stream=True)),
+    ]
+
+
+def measure(setup, run, repeat):
+    """Return (best wall time in seconds, peak traced memory in bytes)."""
+    best = None
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del argument
+
+    argument = setup()
+    tracemalloc.start()
+    try:
+        run(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def benchmark_file(input_file, repeat):
+    """Benchmark every stage on one input and return a result dict."""
+    size = os.path.getsize(input_file)
+    requests = len(ctm.read_chat_file(input_file).get('requests', []))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_file = os.path.join(temp_dir, 'out.md')
+        stages = []
+        for name, setup, run in build_stages(input_file, output_file):
+            seconds, peak = measure(setup, run, repeat)
+            stages.append({
+                'stage': name,
+                'seconds': seconds,
+                'mb_per_s': size / (1024 * 1024) / seconds if seconds else None,
+                'requests_per_s': requests / seconds if seconds else None,
+                'peak_mb': peak / (1024 * 1024),
+            })
+    return {'input': input_file, 'size_mb': size / (1024 * 1024), 'requests': requests, 'stages': stages}
+
+
+def print_table(result):
+    print(f"\n{result['input']}: {result['size_mb']:.1f} MB, {result['requests']} requests")
+    print(f"  {'stage':<32} {'seconds':>9} {'MB/s':>9} {'req/s':>10} {'peak MB':>9}")
+    for stage in result['stages']:
+        print(f"  {stage['stage']:<32} {stage['seconds']:>9.3f} {stage['mb_per_s'] or 0:>9.1f} "
+              f"{stage['requests_per_s'] or 0:>10.1f} {stage['peak_mb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat_to_markdown stage by stage")
+    parser.add_argument('inputs', nargs='*', help='Existing chat export files to benchmark')
+    parser.add_argument('--sizes', help='Comma-separated sizes in MB of synthetic exports to generate (default: 5,25 without inputs)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage; the best is reported (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for synthetic exports (default: 0)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON instead of tables')
+    args = parser.parse_args()
+
+    sizes = args.sizes or ('' if args.inputs else '5,25')
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        inputs = list(args.inputs)
+        for size in filter(None, sizes.split(',')):
+            path = os.path.join(temp_dir, f'synthetic-{size}mb.json')
+            generate_export(path, target_mb=float(size), seed=args.seed)
+            inputs.append(path)
+
+        for input_file in inputs:
+            result = benchmark_file(input_file, args.repeat)
+            if os.path.dirname(input_file) == temp_dir:
+                result['input'] = f"synthetic {os.path.basename(input_file)}"
+            results.append(result)
+            if not args.json:
+                print_table(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
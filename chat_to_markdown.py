@@ -3,136 +3,232 @@
 Convert a Copilot chat log JSON file to markdown format.
 
 Usage: python chat_to_markdown.py input.json output.md
+       python chat_to_markdown.py --stream - - < input.json > output.md
+       python chat_to_markdown.py --shard-requests 100 input.json output.md
+       python chat_to_markdown.py batch exports/ --output-dir markdown/ --jobs 8
+       python chat_to_markdown.py watch exports/ --output-dir markdown/
+       python chat_to_markdown.py scan workspaceStorage/ --output-dir markdown/
+       python chat_to_markdown.py index chats.db exports/
+       python chat_to_markdown.py search chats.db deploy.yaml
+       python chat_to_markdown.py stats exports/ --format csv > stats.csv
 """
 
 import json
+import os
+import re
 import sys
+import functools
+import gc
+import glob
+import gzip
+import hashlib
 import argparse
+import bz2
+import codecs
+import collections
+import collections.abc
+import contextlib
+import concurrent.futures
+import csv
+import io
+import itertools
+import lzma
+import marshal
+import mmap
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, BinaryIO, Callable, Iterable, Iterator, Optional, Set, TextIO, Tuple, Union
 
-def extract_text_from_response_part(part: Dict[str, Any]) -> str:
-    """Extract text content from a response part, handling different formats."""
+class ResponsePart:
+    """A typed piece of an assistant response, rendered by its own formatter."""
+    __slots__ = ()
+
+    def render(self, tool_index: 'ToolCallIndex' = None, options: 'RenderOptions' = None) -> str:
+        """Render the part as markdown; subclasses override this, the base part shows nothing."""
+        return ""
+
+
+class TextPart(ResponsePart):
+    """Plain response text, emitted as-is."""
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def render(self, tool_index: 'ToolCallIndex' = None, options: 'RenderOptions' = None) -> str:
+        return self.text
+
+
+class ToolInvocationPart(ResponsePart):
+    """A 'toolInvocationSerialized' part, shown as a details block."""
+    __slots__ = ('data',)
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+
+    def render(self, tool_index: 'ToolCallIndex' = None, options: 'RenderOptions' = None) -> str:
+        return format_tool_invocation_details(self.data, tool_index=tool_index, options=options)
+
+
+class TextEditGroupPart(ResponsePart):
+    """A 'textEditGroup' part, shown as the file changes it made."""
+    __slots__ = ('data',)
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+
+    def render(self, tool_index: 'ToolCallIndex' = None, options: 'RenderOptions' = None) -> str:
+        return format_text_edit_group(self.data, options, tool_index.store if tool_index is not None else None)
+
+
+class ProgressTaskPart(ResponsePart):
+    """A 'progressTaskSerialized' part, shown as a checkmarked line."""
+    __slots__ = ('data',)
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+
+    def render(self, tool_index: 'ToolCallIndex' = None, options: 'RenderOptions' = None) -> str:
+        return format_progress_task(self.data)
+
+
+def extract_response_part(part: Any) -> Optional[ResponsePart]:
+    """Convert a raw response part into a typed part, or None if it has no content."""
     if isinstance(part, dict):
         # Skip internal VS Code/Copilot metadata
         if 'kind' in part:
             kind = part['kind']
             # Handle textEditGroup - extract edit content for tool invocations
             if kind == 'textEditGroup':
-                return f"__TEXT_EDIT_GROUP__{json.dumps(part)}__TEXT_EDIT_GROUP__"
+                return TextEditGroupPart(part)
             # Skip other internal VS Code objects
             if kind in ['inlineReference', 'undoStop', 'codeblockUri']:
-                return ""
-            # Handle tool invocation messages - return special markers for processing
+                return None
+            # Handle tool invocation messages - formatted when the response is rendered
             if kind == 'toolInvocationSerialized':
-                return f"__TOOL_INVOCATION__{json.dumps(part)}__TOOL_INVOCATION__"
+                return ToolInvocationPart(part)
             elif kind == 'progressTaskSerialized':
-                return f"__PROGRESS_TASK__{json.dumps(part)}__PROGRESS_TASK__"
+                return ProgressTaskPart(part)
             elif kind == 'prepareToolInvocation':
-                return ""  # Skip these as they're handled in toolInvocationSerialized
+                return None  # Skip these as they're handled in toolInvocationSerialized
             # Handle other progress/tool invocation messages
             if 'content' in part and isinstance(part['content'], dict) and 'value' in part['content']:
-                return f"*{part['content']['value']}*"
+                return TextPart(f"*{part['content']['value']}*")
             elif 'invocationMessage' in part and isinstance(part['invocationMessage'], dict) and 'value' in part['invocationMessage']:
-                return f"*{part['invocationMessage']['value']}*"
+                return TextPart(f"*{part['invocationMessage']['value']}*")
             elif 'pastTenseMessage' in part and isinstance(part['pastTenseMessage'], dict) and 'value' in part['pastTenseMessage']:
-                return f"*{part['pastTenseMessage']['value']}*"
+                return TextPart(f"*{part['pastTenseMessage']['value']}*")
             
         # Skip objects with internal IDs, metadata structure, or inline references
         if ('id' in part and ('kind' in part or '$mid' in part)) or '$mid' in part or 'inlineReference' in part:
-            return ""
+            return None
             
         # Handle regular content
         if 'value' in part:
             value = part['value']
             # Skip if the value is just a raw object representation
             if isinstance(value, str) and ('{' in value and '$mid' in value):
-                return ""
+                return None
             # Skip empty code block artifacts from tool invocations
             if isinstance(value, str) and value.strip() == "```":
-                return ""
-            return value
+                return None
+            return TextPart(value)
         elif 'content' in part:
             if isinstance(part['content'], str):
-                return part['content']
+                return TextPart(part['content'])
             elif isinstance(part['content'], dict) and 'value' in part['content']:
-                return part['content']['value']
+                return TextPart(part['content']['value'])
     
     # Skip if the part itself looks like raw metadata
     if isinstance(part, str) and ('{' in part and ('$mid' in part or 'kind' in part)):
-        return ""
+        return None
         
-    return str(part) if part else ""
+    return TextPart(str(part)) if part else None
+
+def extract_response_parts(response: List[Any]) -> List[ResponsePart]:
+    """Convert a raw response list into typed parts, dropping empty text."""
+    parts = []
+    for part in response:
+        typed_part = extract_response_part(part)
+        if typed_part is None:
+            continue
+        if isinstance(typed_part, TextPart):
+            text = typed_part.text
+            if not (text and text.strip()):
+                continue
+        parts.append(typed_part)
+    return parts
+
+def render_response_texts(parts: List[ResponsePart], tool_index: 'ToolCallIndex' = None,
+                          options: 'RenderOptions' = None) -> List[str]:
+    """Render typed response parts into the texts that make up the response."""
+    rendered = []
+    for part in parts:
+        if isinstance(part, TextPart):
+            rendered.append(part.text)
+            continue
+        try:
+            rendered.append(part.render(tool_index, options))
+        except Exception:
+            # A malformed part is dropped rather than failing the whole request
+            rendered.append("")
+    return rendered
+
+def render_response_parts(parts: List[ResponsePart], tool_index: 'ToolCallIndex' = None,
+                          options: 'RenderOptions' = None) -> str:
+    """Render typed response parts and join them into the response text."""
+    return '\n'.join(render_response_texts(parts, tool_index, options))
+
+def iter_formatted_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Format message lines with proper markdown, one line at a time.
+
+    Artifact filtering, the checkmark fix-up, rstrip and blank-line collapsing
+    are fused into a single pass, so the lines can come from any iterator.
+    """
+    prev_checkmark = False
+    prev_blank = False
+    pending_blank = False
+    for line in lines:
+        # Remove any remaining raw object representations
+        if '{' in line and ('$mid' in line or 'kind' in line):
+            continue
+
+        # Many markdown renderers don't properly separate lines that start with emojis,
+        # so a checkmark line that follows another one gets a <br> before it
+        checkmark = line.lstrip().startswith('✅')
+        if checkmark and prev_checkmark:
+            line = '<br>' + line
+        prev_checkmark = checkmark
+
+        # Clean up the line but preserve leading spaces for formatting
+        line = line.rstrip()
+        if not line:
+            # Collapse consecutive blank lines; a blank is only emitted once a
+            # non-blank line follows it, which drops trailing blank lines
+            if not prev_blank:
+                pending_blank = True
+            prev_blank = True
+            continue
+        if pending_blank:
+            yield ''
+            pending_blank = False
+        prev_blank = False
+        yield line
 
 def format_message_text(text: str) -> str:
     """Format message text with proper markdown."""
     if not text:
         return ""
-    
-    # Remove any remaining raw object representations
-    if '{' in text and ('$mid' in text or 'kind' in text):
-        # Try to clean out just the problematic parts
-        lines = text.split('\n')
-        clean_lines = []
-        for line in lines:
-            if not ('{' in line and ('$mid' in line or 'kind' in line)):
-                clean_lines.append(line)
-        text = '\n'.join(clean_lines)
-    
-    # Fix checkmark lists that need proper spacing for markdown rendering
-    # Many markdown renderers don't properly separate lines that start with emojis
-    import re
-    lines = text.split('\n')
-    formatted_lines = []
-    
-    for i, line in enumerate(lines):
-        # If this line starts with a checkmark and it's not the first checkmark in a sequence,
-        # add a <br> before it to force a line break
-        if (line.strip().startswith('✅') and 
-            i > 0 and 
-            not lines[i - 1].strip().startswith('✅') and
-            lines[i - 1].strip() != ''):
-            formatted_lines.append(line)
-        elif (line.strip().startswith('✅') and 
-              i > 0 and 
-              lines[i - 1].strip().startswith('✅')):
-            formatted_lines.append('<br>' + line)
-        else:
-            formatted_lines.append(line)
-    
-    text = '\n'.join(formatted_lines)
-    
-    # Clean up excessive whitespace but preserve intentional line breaks
-    lines = text.split('\n')
-    formatted_lines = []
-    
-    for line in lines:
-        # Clean up the line but preserve leading/trailing spaces for formatting
-        clean_line = line.rstrip()
-        formatted_lines.append(clean_line)
-    
-    
-    # Remove excessive blank lines and clean up artifacts
-    result_lines = []
-    prev_blank = False
-    
-    for line in formatted_lines:
-        is_blank = line.strip() == ''
-        # Skip consecutive blank lines
-        if is_blank and prev_blank:
-            continue
-        # Skip lines that are just malformed artifacts
-        if line.strip() and not ('{' in line and ('$mid' in line or 'kind' in line)):
-            result_lines.append(line)
-        elif is_blank:
-            result_lines.append(line)
-        prev_blank = is_blank
-    
-    # Remove trailing empty lines
-    while result_lines and result_lines[-1].strip() == '':
-        result_lines.pop()
-    
-    return '\n'.join(result_lines)
+    return '\n'.join(iter_formatted_lines(text.split('\n')))
+
+def format_message_lines(texts: Iterable[str]) -> str:
+    """Format the newline-joined concatenation of texts without joining them first."""
+    return '\n'.join(iter_formatted_lines(line for text in texts for line in text.split('\n')))
 
 def format_timestamp(timestamp_ms: int) -> str:
     """Format timestamp from milliseconds to readable format."""
@@ -172,18 +268,36 @@ def format_error_message(error_details: Dict[str, Any]) -> str:
     lines.append("")
     return '\n'.join(lines)
 
-def format_references(variables: List[Dict[str, Any]]) -> str:
+def _intern(value: Any) -> Any:
+    """Intern strings that repeat across requests (kinds, names, model ids)."""
+    return sys.intern(value) if type(value) is str else value
+
+
+class Reference:
+    """A reference attached to a request (an instructions file, a selection, ...)."""
+    __slots__ = ('name', 'kind', 'origin_label')
+
+    def __init__(self, name: Any = 'Unknown', kind: Any = '', origin_label: Any = ''):
+        self.name = _intern(name)
+        self.kind = _intern(kind)
+        self.origin_label = _intern(origin_label)
+
+    @classmethod
+    def from_dict(cls, variable: Dict[str, Any]) -> 'Reference':
+        return cls(variable.get('name', 'Unknown'), variable.get('kind', ''), variable.get('originLabel', ''))
+
+def format_references(references: List[Reference]) -> str:
     """Format variable data references in the expandable format."""
-    if not variables:
+    if not references:
         return ""
     
     content_lines = []
     reference_count = 0
     
-    for var in variables:
-        name = var.get('name', 'Unknown')
-        kind = var.get('kind', '')
-        origin_label = var.get('originLabel', '')
+    for reference in references:
+        name = reference.name
+        kind = reference.kind
+        origin_label = reference.origin_label
         
         # Format the reference name
         if name.startswith('prompt:'):
@@ -216,17 +330,179 @@ def format_references(variables: List[Dict[str, Any]]) -> str:
 
 """
 
-def extract_content_from_tool_result(tool_result: Dict[str, Any]) -> str:
-    """Extract readable content from a tool call result structure."""
+class RenderOptions:
+    """Settings that change the rendered markdown; a None limit means no limit.
+
+    `max_tool_output_bytes` caps the content shown for each tool result,
+    `max_edit_bytes` the text shown for each file edit group, and `max_lines`
+    the lines of either. With `dedupe`, a tool result or edit block whose
+    content was already shown is replaced by a reference to the first one.
+    """
+    __slots__ = ('max_tool_output_bytes', 'max_edit_bytes', 'max_lines', 'dedupe')
+
+    def __init__(self, max_tool_output_bytes: Optional[int] = None, max_edit_bytes: Optional[int] = None,
+                 max_lines: Optional[int] = None, dedupe: bool = False):
+        self.max_tool_output_bytes = max_tool_output_bytes
+        self.max_edit_bytes = max_edit_bytes
+        self.max_lines = max_lines
+        self.dedupe = dedupe
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The options as a JSON-serializable dict."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+DEFAULT_RENDER_OPTIONS = RenderOptions()
+
+
+class ContentStore:
+    """Where each tool result and edit block of a session was first shown, by content hash.
+
+    Blocks are numbered per kind within their request ("read #3"), so a
+    repeated block can be rendered as a reference to its first occurrence.
+    A block's key hashes the data it is rendered from, so a repeat is known
+    before any rendering work and is never formatted or truncated again.
+    Only keys are kept, so the store grows with the number of distinct
+    blocks rather than their size.
+    """
+    __slots__ = ('request', '_first_seen', '_counts', '_new')
+
+    # Stand-in content of a block that was already shown: only a non-empty
+    # placeholder, since the block is rendered as a reference to the first copy
+    REPEATED = '(shown earlier)'
+
+    def __init__(self):
+        self.request = None
+        self._first_seen = {}
+        self._counts = {}
+        # (key, number) of blocks first shown in the current request
+        self._new = []
+
+    @staticmethod
+    def key(kind: str, data: Any) -> str:
+        """The key of a block of this kind rendered from JSON-serializable data."""
+        return kind + ':' + hashlib.sha1(json.dumps(data).encode('ascii')).hexdigest()
+
+    def begin_request(self, i: int) -> None:
+        self.request = i
+        self._counts = {}
+        self._new = []
+
+    def add(self, key: str, request: int, number: int) -> None:
+        """Record a block shown in an earlier run (see new_blocks)."""
+        self._first_seen.setdefault(key, (request, number))
+
+    def seen(self, key: str) -> bool:
+        return key in self._first_seen
+
+    def claim(self, kind: str, key: str) -> Optional[Tuple[int, int]]:
+        """Number a block of the current request; return (request, number) of an identical earlier one."""
+        number = self._counts[kind] = self._counts.get(kind, 0) + 1
+        first = self._first_seen.get(key)
+        if first is None:
+            self._first_seen[key] = (self.request, number)
+            self._new.append([key, number])
+        return first
+
+    def new_blocks(self) -> List[List[Any]]:
+        """[key, number] of each block first shown in the current request."""
+        return list(self._new)
+
+
+def format_duplicate_block(summary: str, kind: str, first: Tuple[int, int]) -> str:
+    """Format a details block that points to the identical block shown earlier."""
+    request, number = first
+    return (f"<details>\n  <summary>{summary}</summary>\n"
+            f"  <p>Same content as <a href=\"#request-{request}\">Request {request}</a>, {kind} #{number}</p>\n"
+            f"</details>\n\n")
+
+
+class TextBudget:
+    """Collect text pieces up to a byte and line limit, measuring what is dropped.
+
+    Once a limit is reached, later pieces are only measured, so the oversized
+    text is never built. Where possible the kept text ends at a line break.
+    """
+    __slots__ = ('max_bytes', 'max_lines', 'parts', 'truncated', 'shown_bytes', 'total_bytes', 'total_lines',
+                 '_open_line')
+
+    def __init__(self, max_bytes: Optional[int] = None, max_lines: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.parts = []
+        self.truncated = False
+        self.shown_bytes = 0
+        self.total_bytes = 0
+        self.total_lines = 0
+        # Whether the text so far ends in an unterminated line
+        self._open_line = False
+
+    def add(self, text: str) -> None:
+        """Append a piece of text, or as much of it as the limits allow."""
+        if self.max_bytes is None and self.max_lines is None:
+            self.parts.append(text)
+            return
+
+        size = len(text.encode('utf-8', errors='replace'))
+        self.total_bytes += size
+        self.total_lines += text.count('\n')
+        if text:
+            self._open_line = not text.endswith('\n')
+        if self.truncated:
+            return
+
+        kept = text
+        if self.max_bytes is not None and self.shown_bytes + size > self.max_bytes:
+            data = text.encode('utf-8', errors='replace')[:self.max_bytes - self.shown_bytes]
+            kept = data.decode('utf-8', errors='ignore')
+            # Cut at the last line break rather than mid-line; only a first
+            # piece without any line break is cut mid-line
+            line_end = kept.rfind('\n')
+            if line_end >= 0 or self.parts:
+                kept = kept[:line_end + 1]
+        if self.max_lines is not None:
+            lines_left = self.max_lines - (self.total_lines - text.count('\n'))
+            pieces = kept.split('\n', lines_left)
+            if len(pieces) > lines_left and pieces[-1]:
+                kept = ''.join(piece + '\n' for piece in pieces[:lines_left])
+
+        if len(kept) < len(text):
+            self.truncated = True
+            size = len(kept.encode('utf-8', errors='replace'))
+        self.parts.append(kept)
+        self.shown_bytes += size
+
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+    def note(self, detail: str = '') -> str:
+        """A line marking the truncation and reporting the original size."""
+        lines = self.total_lines + self._open_line
+        return (f"[... truncated: showing {self.shown_bytes:,} of {self.total_bytes:,} bytes "
+                f"({lines:,} line{'' if lines == 1 else 's'}){detail} ...]")
+
+
+def truncate_text(text: str, max_bytes: Optional[int] = None, max_lines: Optional[int] = None) -> str:
+    """Cut text down to the given limits, ending it with a truncation note if anything was dropped."""
+    budget = TextBudget(max_bytes, max_lines)
+    budget.add(text)
+    if not budget.truncated:
+        return text
+    kept = budget.text()
+    if kept and not kept.endswith('\n'):
+        kept += '\n'
+    return kept + budget.note()
+
+
+def tool_result_texts(tool_result: Dict[str, Any]) -> List[str]:
+    """Collect the non-blank text pieces of a tool call result structure, in order."""
+    texts = []
     if not tool_result or not isinstance(tool_result, dict):
-        return ""
+        return texts
     
     content = tool_result.get('content', [])
     if not isinstance(content, list) or not content:
-        return ""
-    
-    # Look for the content in the nested structure
-    text_parts = []
+        return texts
     
     def extract_text_recursive(node):
         """Recursively extract text from nested node structure."""
@@ -235,7 +511,7 @@ def extract_content_from_tool_result(tool_result: Dict[str, Any]) -> str:
             if 'text' in node:
                 text = node['text']
                 if isinstance(text, str) and text.strip():
-                    text_parts.append(text)
+                    texts.append(text)
             
             # Check for children
             if 'children' in node and isinstance(node['children'], list):
@@ -257,27 +533,199 @@ def extract_content_from_tool_result(tool_result: Dict[str, Any]) -> str:
     # Process each content item
     for content_item in content:
         extract_text_recursive(content_item)
+    return texts
+
+def _leading_fence_open(text: str) -> bool:
+    """Whether text starts with a code fence that isn't closed within it."""
+    if not text.lstrip().startswith('```'):
+        return False
+    fences = sum(1 for line in text.split('\n') if line.strip().startswith('```'))
+    return fences % 2 == 1
+
+def format_tool_result_texts(texts: List[str], options: RenderOptions = None) -> str:
+    """Join the text pieces of a tool result into readable content, within the size limits."""
+    if not texts:
+        return ""
+
+    if options is None:
+        options = DEFAULT_RENDER_OPTIONS
+    budget = TextBudget(options.max_tool_output_bytes, options.max_lines)
+    for text in texts:
+        budget.add(text)
+
+    # Join and clean up the extracted text
+    full_text = budget.text()
+    if budget.truncated and texts[-1].strip() == '```' and _leading_fence_open(full_text):
+        # Keep the closing fence so a fenced result is still unwrapped below
+        full_text += texts[-1]
     
-    if text_parts:
-        # Join and clean up the extracted text
-        full_text = ''.join(text_parts)
-        
-        # Clean up common artifacts
-        # Remove markdown code block markers at start/end if they wrap the entire content
-        full_text = full_text.strip()
-        if full_text.startswith('```') and full_text.endswith('```'):
-            lines = full_text.split('\n')
-            if len(lines) >= 2:
-                # Remove first and last lines if they're just code block markers
-                if lines[0].strip().startswith('```') and lines[-1].strip() == '```':
-                    full_text = '\n'.join(lines[1:-1])
-        
-        return full_text
+    # Clean up common artifacts
+    # Remove markdown code block markers at start/end if they wrap the entire content
+    full_text = full_text.strip()
+    if full_text.startswith('```') and full_text.endswith('```'):
+        lines = full_text.split('\n')
+        if len(lines) >= 2:
+            # Remove first and last lines if they're just code block markers
+            if lines[0].strip().startswith('```') and lines[-1].strip() == '```':
+                full_text = '\n'.join(lines[1:-1])
     
-    return ""
+    if budget.truncated:
+        full_text = full_text.rstrip('\n') + '\n' + budget.note()
+    return full_text
+
+def extract_content_from_tool_result(tool_result: Dict[str, Any], options: RenderOptions = None) -> str:
+    """Extract readable content from a tool call result structure."""
+    return format_tool_result_texts(tool_result_texts(tool_result), options)
+
+
+class ToolResult:
+    """The text pieces of a tool call result, without its node structure."""
+    __slots__ = ('texts',)
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+
+
+_FILE_URI_PATH = re.compile(r'file://([^)#\s]+)')
+
+
+# (whether any read_file call was seen, {filePath: [(round index, call order, tool call id), ...]})
+ReadCalls = Tuple[bool, Dict[str, List[Tuple[int, int, Any]]]]
+
+
+def index_read_calls(tool_call_results: Dict[str, Any], tool_call_rounds: List[Dict[str, Any]]) -> ReadCalls:
+    """Index a request's read_file tool calls by the path they read, in call order.
+
+    Only calls with string arguments count as seen; calls are only indexed
+    when the request has tool call results to show.
+    """
+    has_read_calls = False
+    reads_by_path = {}
+    if not (tool_call_results and tool_call_rounds):
+        return has_read_calls, reads_by_path
+
+    order = 0
+    for round_index, round_data in enumerate(tool_call_rounds):
+        if not (isinstance(round_data, dict) and 'toolCalls' in round_data):
+            continue
+        for tool_call in round_data['toolCalls']:
+            if not isinstance(tool_call, dict) or tool_call.get('name', '') != 'read_file':
+                continue
+            arguments = tool_call.get('arguments', '')
+            if not isinstance(arguments, str):
+                continue
+            has_read_calls = True
+            try:
+                file_path = json.loads(arguments).get('filePath', '')
+            except Exception:
+                continue
+            if file_path and isinstance(file_path, str):
+                reads = reads_by_path.setdefault(file_path, [])
+                reads.append((round_index, order, tool_call.get('id', '')))
+                order += 1
+    return has_read_calls, reads_by_path
+
+
+class ToolCallIndex:
+    """Per-request index of read_file tool calls and their extracted results.
 
-def format_tool_invocation_details(tool_data: Dict[str, Any], tool_call_results: Dict[str, Any] = None, tool_call_rounds: List[Dict[str, Any]] = None) -> str:
+    Built once per request so that each tool invocation can find its file
+    contents with a dictionary lookup instead of re-parsing every tool call's
+    arguments. `read_calls` is the index_read_calls() of the request when it
+    was already built (see ChatRequest).
+    """
+    __slots__ = ('tool_call_results', 'options', 'store', 'has_read_calls', '_reads_by_path', '_content_by_id',
+                 '_content_by_message', '_key_by_id', '_key_by_message')
+
+    def __init__(self, tool_call_results: Dict[str, Any] = None, tool_call_rounds: List[Dict[str, Any]] = None,
+                 options: RenderOptions = None, store: ContentStore = None, read_calls: ReadCalls = None):
+        self.tool_call_results = tool_call_results or {}
+        # Size limits applied when result contents are extracted
+        self.options = options or DEFAULT_RENDER_OPTIONS
+        # Session-wide record of shown blocks, when deduplicating
+        self.store = store
+        if read_calls is None:
+            read_calls = index_read_calls(tool_call_results, tool_call_rounds)
+        # Whether any read_file call with string arguments was seen, and
+        # filePath -> [(round index, call order, tool call id), ...] in call order
+        self.has_read_calls, self._reads_by_path = read_calls
+        self._content_by_id = {}
+        self._content_by_message = {}
+        # ContentStore keys of the results, when deduplicating
+        self._key_by_id = {}
+        self._key_by_message = {}
+
+    def result_content(self, tool_call_id: str) -> str:
+        """Return the extracted content of a tool call result, cached by id."""
+        content = self._content_by_id.get(tool_call_id)
+        if content is None:
+            tool_result = self.tool_call_results[tool_call_id]
+            texts = tool_result.texts if isinstance(tool_result, ToolResult) else tool_result_texts(tool_result)
+            if self.store is None:
+                content = format_tool_result_texts(texts, self.options)
+            else:
+                # A result already shown in the session isn't formatted again
+                key = self._key_by_id[tool_call_id] = ContentStore.key('read', texts)
+                if self.store.seen(key):
+                    content = ContentStore.REPEATED
+                else:
+                    content = format_tool_result_texts(texts, self.options)
+            self._content_by_id[tool_call_id] = content
+        return content
+
+    def read_file_content(self, invocation_msg: str) -> str:
+        """Return the file contents read by the invocation with this message."""
+        content = self._content_by_message.get(invocation_msg)
+        if content is not None:
+            return content
+
+        # Candidate paths come from the file:// links in the message
+        reads = []
+        for file_path in set(_FILE_URI_PATH.findall(invocation_msg)):
+            reads.extend(self._reads_by_path.get(file_path, ()))
+        reads.sort()
+
+        # Within each round the first read with a result wins; an empty result
+        # moves on to the next round
+        content = ""
+        skip_round = None
+        for round_index, _, tool_call_id in reads:
+            if round_index == skip_round or tool_call_id not in self.tool_call_results:
+                continue
+            content = self.result_content(tool_call_id)
+            if content:
+                if tool_call_id in self._key_by_id:
+                    self._key_by_message[invocation_msg] = self._key_by_id[tool_call_id]
+                break
+            skip_round = round_index
+
+        self._content_by_message[invocation_msg] = content
+        return content
+
+    def read_file_key(self, invocation_msg: str) -> str:
+        """The ContentStore key of the contents returned by read_file_content, when deduplicating."""
+        return self._key_by_message[invocation_msg]
+
+# Map file extensions to language identifiers
+LANGUAGE_BY_EXTENSION = {
+    '.md': 'markdown',
+    '.py': 'python',
+    '.js': 'javascript',
+    '.json': 'json',
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.html': 'html',
+    '.css': 'css',
+    '.sh': 'bash',
+    '.txt': 'text'
+}
+
+_FILE_EXTENSION = re.compile(r'(\.\w+)')
+
+def format_tool_invocation_details(tool_data: Dict[str, Any], tool_call_results: Dict[str, Any] = None, tool_call_rounds: List[Dict[str, Any]] = None, tool_index: ToolCallIndex = None, options: RenderOptions = None) -> str:
     """Format tool invocation with input/output in expandable format."""
+    if options is None:
+        options = tool_index.options if tool_index is not None else DEFAULT_RENDER_OPTIONS
     past_tense = tool_data.get('pastTenseMessage', {}).get('value', 'Ran tool')
     invocation_msg = tool_data.get('invocationMessage', '')
     if isinstance(invocation_msg, dict):
@@ -314,37 +762,13 @@ def format_tool_invocation_details(tool_data: Dict[str, Any], tool_call_results:
     # Simple cleanup for other "Reading" patterns
     invocation_msg = invocation_msg.replace('Reading ', 'Read ')
     
-    # Try to find the corresponding tool call in tool_call_rounds by matching the invocation message
+    # Look up the file contents read by this invocation, if any
     tool_result_content = ""
     
-    if tool_call_results and tool_call_rounds:
-        # Look for a tool call that matches this invocation
-        for round_data in tool_call_rounds:
-            if isinstance(round_data, dict) and 'toolCalls' in round_data:
-                for tool_call in round_data['toolCalls']:
-                    if isinstance(tool_call, dict):
-                        tool_call_id = tool_call.get('id', '')
-                        tool_name = tool_call.get('name', '')
-                        
-                        # Try to match by tool name and arguments (for file reads)
-                        if tool_name == 'read_file' and 'Read' in original_invocation_msg:
-                            # Extract file path from arguments to match with invocation message
-                            arguments = tool_call.get('arguments', '')
-                            if isinstance(arguments, str):
-                                try:
-                                    import json
-                                    args_dict = json.loads(arguments)
-                                    file_path = args_dict.get('filePath', '')
-                                    # Use original invocation message for comparison
-                                    if file_path and file_path in original_invocation_msg:
-                                        # Found matching tool call, get its result
-                                        if tool_call_id in tool_call_results:
-                                            tool_result_content = extract_content_from_tool_result(tool_call_results[tool_call_id])
-                                            break
-                                except:
-                                    continue
-            if tool_result_content:
-                break
+    if tool_index is None:
+        tool_index = ToolCallIndex(tool_call_results, tool_call_rounds, options)
+    if 'Read' in original_invocation_msg:
+        tool_result_content = tool_index.read_file_content(original_invocation_msg)
     
     # Fallback to old method for result details
     result_details = tool_data.get('resultDetails', {})
@@ -353,6 +777,10 @@ def format_tool_invocation_details(tool_data: Dict[str, Any], tool_call_results:
     
     # If we have tool result content, use it; otherwise fall back to old method
     if tool_result_content.strip():
+        if tool_index.store is not None:
+            first = tool_index.store.claim('read', tool_index.read_file_key(original_invocation_msg))
+            if first:
+                return format_duplicate_block(invocation_msg, 'read', first)
         # Build the details block with actual file content
         lines = []
         lines.append(f"<details>")
@@ -372,25 +800,11 @@ def format_tool_invocation_details(tool_data: Dict[str, Any], tool_call_results:
             # Determine content type for syntax highlighting
             file_ext = ""
             if 'file://' in original_invocation_msg:
-                import re
-                file_match = re.search(r'(\.\w+)', original_invocation_msg)
+                file_match = _FILE_EXTENSION.search(original_invocation_msg)
                 if file_match:
                     file_ext = file_match.group(1)
             
-            # Map file extensions to language identifiers
-            lang_map = {
-                '.md': 'markdown',
-                '.py': 'python', 
-                '.js': 'javascript',
-                '.json': 'json',
-                '.yaml': 'yaml',
-                '.yml': 'yaml',
-                '.html': 'html',
-                '.css': 'css',
-                '.sh': 'bash',
-                '.txt': 'text'
-            }
-            lang = lang_map.get(file_ext, '')
+            lang = LANGUAGE_BY_EXTENSION.get(file_ext, '')
             
             lines.append(f"```{lang}")
             lines.append(tool_result_content.rstrip())
@@ -405,6 +819,11 @@ def format_tool_invocation_details(tool_data: Dict[str, Any], tool_call_results:
     if not input_data:
         return ""
     
+    # The structured Input/Output block has only ever been produced after a
+    # read_file lookup was attempted; keep the compact form everywhere else
+    if not ('Read' in original_invocation_msg and tool_index.has_read_calls):
+        return f"<details>\n  <summary>{invocation_msg}</summary>\n  <p>Completed with input: {input_data}</p>\n</details>\n\n"
+    
     try:
         if isinstance(input_data, str):
             input_obj = json.loads(input_data)
@@ -428,6 +847,8 @@ def format_tool_invocation_details(tool_data: Dict[str, Any], tool_call_results:
         # Add output if available
         if output_data and isinstance(output_data, list) and output_data:
             output_value = output_data[0].get('value', '') if isinstance(output_data[0], dict) else str(output_data[0])
+            if isinstance(output_value, str):
+                output_value = truncate_text(output_value, options.max_tool_output_bytes, options.max_lines)
             lines.append(f"  <p>Output</p>")
             lines.append(f"")
             lines.append(f"```json")
@@ -444,8 +865,38 @@ def format_tool_invocation_details(tool_data: Dict[str, Any], tool_call_results:
         return f"<details>\n  <summary>{invocation_msg}</summary>\n  <p>Completed with input: {input_data}</p>\n</details>\n\n"
 
 
-def format_text_edit_group(edit_data: Dict[str, Any]) -> str:
+# Runs of blank lines collapsed to one when adjacent edits are combined
+_EXCESS_BLANK_LINES = re.compile(r'\n\s*\n\s*\n+')
+
+def merge_adjacent_edits(edits: List[Dict[str, Any]]) -> List[Tuple[int, List[Tuple[Any, Dict[str, Any]]]]]:
+    """Group edits with adjacent line ranges in one pass over the edits sorted by start line.
+
+    An edit joins the current group when it starts at most two lines after the
+    end of the group's last edit; edits without a line number are never
+    joined. Returns (position of the group's first edit in line order,
+    [(start line, edit), ...]) for each group.
+    """
+    keyed = []
+    for edit in edits:
+        edit_range = edit.get('range', {})
+        keyed.append((edit_range.get('startLineNumber', 0) if edit_range else 0, edit))
+    keyed.sort(key=lambda item: item[0])
+
+    groups = []
+    prev_end = 0
+    for index, (start, edit) in enumerate(keyed):
+        if groups and start != 0 and prev_end != 0 and start <= prev_end + 2:
+            groups[-1][1].append((start, edit))
+        else:
+            groups.append((index, [(start, edit)]))
+        edit_range = edit.get('range', {})
+        prev_end = edit_range.get('endLineNumber', start) if edit_range else start
+    return groups
+
+def format_text_edit_group(edit_data: Dict[str, Any], options: RenderOptions = None, store: ContentStore = None) -> str:
     """Format textEditGroup data showing the actual file changes."""
+    if options is None:
+        options = DEFAULT_RENDER_OPTIONS
     try:
         uri = edit_data.get('uri', {})
         file_path = uri.get('fsPath', '')
@@ -460,8 +911,17 @@ def format_text_edit_group(edit_data: Dict[str, Any]) -> str:
         if not edits:
             return ""
         
-        # Collect all meaningful edits
+        key = None
+        if store is not None:
+            key = ContentStore.key('edit', [uri, edits])
+            if store.seen(key):
+                # The same group was shown earlier in the session; skip rendering it
+                return format_duplicate_block(f"🛠️ File Edit: {file_name}", 'edit', store.claim('edit', key))
+        
+        # Collect all meaningful edits, within the size limits
         all_edits = []
+        budget = TextBudget(options.max_edit_bytes, options.max_lines)
+        edit_count = 0
         for edit_group in edits:
             if not edit_group:
                 continue
@@ -471,6 +931,16 @@ def format_text_edit_group(edit_data: Dict[str, Any]) -> str:
                 
                 text_content = edit.get('text', '')
                 if text_content and text_content.strip():  # Only include non-empty edits
+                    edit_count += 1
+                    if budget.truncated:
+                        budget.add(text_content)
+                        continue
+                    budget.add(text_content)
+                    if budget.truncated:
+                        # Keep the part that fits; the truncation note is added below
+                        if all_edits and not budget.parts[-1].strip():
+                            continue
+                        edit = dict(edit, text=budget.parts[-1])
                     all_edits.append(edit)
         
         if not all_edits:
@@ -547,77 +1017,32 @@ def format_text_edit_group(edit_data: Dict[str, Any]) -> str:
             lines.append(f"  <p><strong>Multiple file changes ({len(all_edits)} edits)</strong></p>")
             lines.append(f"")
             
-            # Sort edits by line number for better grouping
-            sorted_edits = []
-            for edit in all_edits:
-                edit_range = edit.get('range', {})
-                start_line = edit_range.get('startLineNumber', 0) if edit_range else 0
-                sorted_edits.append((start_line, edit))
-            sorted_edits.sort(key=lambda x: x[0])
-            
-            # Combine all edits into one code block, grouping consecutive lines
+            # Combine all edits into one code block, one section per group of adjacent edits
             combined_content = []
+            # Whether some edit text holds a code fence, needing a longer one around it
             has_code_blocks = False
-            
-            i = 0
-            while i < len(sorted_edits):
-                start_line_num, edit = sorted_edits[i]
-                text_content = edit.get('text', '')
-                edit_range = edit.get('range', {})
-                
-                # Check if any content has code blocks
-                if '```' in text_content:
-                    has_code_blocks = True
-                
-                # Look ahead to find consecutive edits
-                consecutive_edits = [(start_line_num, edit)]
-                j = i + 1
-                
-                while j < len(sorted_edits):
-                    next_line_num, next_edit = sorted_edits[j]
-                    prev_line_num = consecutive_edits[-1][0]
-                    prev_edit_range = consecutive_edits[-1][1].get('range', {})
-                    prev_end_line = prev_edit_range.get('endLineNumber', prev_line_num) if prev_edit_range else prev_line_num
-                    
-                    # Check if this edit is consecutive (starts within 1-2 lines of previous end)
-                    if next_line_num != 0 and prev_end_line != 0 and next_line_num <= prev_end_line + 2:
-                        consecutive_edits.append((next_line_num, next_edit))
-                        j += 1
-                    else:
-                        break
-                
-                # Format the group of consecutive edits
-                if len(consecutive_edits) > 1:
+            groups = merge_adjacent_edits(all_edits)
+            for group_number, (index, group) in enumerate(groups, 1):
+                if len(group) > 1:
                     # Multiple consecutive edits - show range and combine content
-                    first_line = consecutive_edits[0][0]
-                    last_edit_range = consecutive_edits[-1][1].get('range', {})
-                    last_line = last_edit_range.get('endLineNumber', consecutive_edits[-1][0]) if last_edit_range else consecutive_edits[-1][0]
+                    first_line = group[0][0]
+                    last_start, last_edit = group[-1]
+                    last_edit_range = last_edit.get('range', {})
+                    last_line = last_edit_range.get('endLineNumber', last_start) if last_edit_range else last_start
                     
                     if first_line and last_line:
                         combined_content.append(f"# Lines {first_line}-{last_line}:")
                     
-                    # Combine all consecutive edits into a single coherent text block
-                    consecutive_text_parts = []
-                    for _, cons_edit in consecutive_edits:
-                        cons_text = cons_edit.get('text', '')
-                        if cons_text is not None:
-                            # Strip only leading/trailing whitespace, but preserve internal structure
-                            cons_text = cons_text.strip()
-                            consecutive_text_parts.append(cons_text)  # Include even empty strings to preserve spacing
-                    
-                    # Join and clean up the consecutive parts
-                    if consecutive_text_parts:
-                        combined_consecutive = '\n'.join(consecutive_text_parts)
-                        # Remove excessive consecutive blank lines but preserve intentional spacing
-                        import re
-                        # Replace multiple consecutive blank lines with maximum of 2 blank lines
-                        combined_consecutive = re.sub(r'\n\s*\n\s*\n+', '\n\n', combined_consecutive)
-                        # Remove any leading/trailing blank lines from the combined content
-                        combined_consecutive = combined_consecutive.strip()
-                        if combined_consecutive:
-                            combined_content.append(combined_consecutive)
+                    # Strip each edit, then keep at most one blank line in a row
+                    combined_consecutive = _EXCESS_BLANK_LINES.sub(
+                        '\n\n', '\n'.join(edit.get('text', '').strip() for _, edit in group)).strip()
+                    if combined_consecutive:
+                        combined_content.append(combined_consecutive)
+                        has_code_blocks = has_code_blocks or '```' in combined_consecutive
                 else:
                     # Single edit - show line number
+                    edit = group[0][1]
+                    edit_range = edit.get('range', {})
                     if edit_range:
                         start_line = edit_range.get('startLineNumber', '')
                         end_line = edit_range.get('endLineNumber', '')
@@ -627,20 +1052,21 @@ def format_text_edit_group(edit_data: Dict[str, Any]) -> str:
                             else:
                                 combined_content.append(f"# Lines {start_line}-{end_line}:")
                         else:
-                            combined_content.append(f"# Edit {i+1}:")
+                            combined_content.append(f"# Edit {index + 1}:")
                     else:
-                        combined_content.append(f"# Edit {i+1}:")
+                        combined_content.append(f"# Edit {index + 1}:")
                     
-                    combined_content.append(text_content.rstrip())
+                    text_content = edit.get('text', '').rstrip()
+                    combined_content.append(text_content)
+                    has_code_blocks = has_code_blocks or '```' in text_content
                 
                 # Add separator between groups (except for the last one)
-                i = j
-                if i < len(sorted_edits):
+                if group_number < len(groups):
                     combined_content.append("")  # Blank line separator
             
             # Use 4 backticks if content has code blocks, otherwise 3
             final_content = '\n'.join(combined_content)
-            if has_code_blocks or '```' in final_content:
+            if has_code_blocks:
                 lines.append(f"````{lang}")
                 lines.append(final_content)
                 lines.append(f"````")
@@ -649,9 +1075,18 @@ def format_text_edit_group(edit_data: Dict[str, Any]) -> str:
                 lines.append(final_content)
                 lines.append(f"```")
         
+        if budget.truncated:
+            # Below the whole block, since the edits may be shown in line order rather than the kept order
+            lines.append(f"")
+            lines.append(budget.note(f", {len(all_edits)} of {edit_count} edits"))
+        
         lines.append(f"")
         lines.append(f"</details>")
         
+        if store is not None:
+            first = store.claim('edit', key)
+            if first:
+                return format_duplicate_block(f"🛠️ File Edit: {file_name}", 'edit', first)
         return '\n'.join(lines) + '\n\n'
         
     except Exception as e:
@@ -666,42 +1101,6 @@ def format_progress_task(task_data: Dict[str, Any]) -> str:
             return f"\n✔️ {value}\n"
     return ""
 
-def process_special_markers(text: str, tool_call_results: Dict[str, Any] = None, tool_call_rounds: List[Dict[str, Any]] = None) -> str:
-    """Process special markers for tool invocations and progress tasks."""
-    import re
-    
-    # Process text edit group markers
-    def replace_text_edit_group(match):
-        try:
-            edit_data = json.loads(match.group(1))
-            return format_text_edit_group(edit_data)
-        except:
-            return ""
-    
-    text = re.sub(r'__TEXT_EDIT_GROUP__(.*?)__TEXT_EDIT_GROUP__', replace_text_edit_group, text, flags=re.DOTALL)
-    
-    # Process tool invocation markers
-    def replace_tool_invocation(match):
-        try:
-            tool_data = json.loads(match.group(1))
-            return format_tool_invocation_details(tool_data, tool_call_results, tool_call_rounds)
-        except:
-            return ""
-    
-    text = re.sub(r'__TOOL_INVOCATION__(.*?)__TOOL_INVOCATION__', replace_tool_invocation, text, flags=re.DOTALL)
-    
-    # Process progress task markers
-    def replace_progress_task(match):
-        try:
-            task_data = json.loads(match.group(1))
-            return format_progress_task(task_data)
-        except:
-            return ""
-    
-    text = re.sub(r'__PROGRESS_TASK__(.*?)__PROGRESS_TASK__', replace_progress_task, text, flags=re.DOTALL)
-    
-    return text
-
 def format_tool_calls(tool_calls: list) -> str:
     """Format tool calls for display."""
     if not tool_calls:
@@ -755,8 +1154,231 @@ def format_tool_calls(tool_calls: list) -> str:
     
     return '\n'.join(formatted_calls) + '\n'
 
-def parse_chat_log(chat_data: Dict[str, Any]) -> str:
-    """Parse the chat log JSON and convert to markdown."""
+def request_preview(request: Dict[str, Any]) -> str:
+    """Return the Table of Contents preview line for a request."""
+    # Extract first line of user message for preview
+    message = request.get('message', {})
+    preview = ""
+    if isinstance(message, dict):
+        if 'text' in message:
+            preview = message['text']
+        elif 'parts' in message:
+            parts = message['parts']
+            if isinstance(parts, list):
+                for part in parts:
+                    if isinstance(part, dict) and 'text' in part:
+                        preview = part['text']
+                        break
+
+    # Get first line for preview (limit to 80 chars)
+    if preview:
+        first_line = preview.split('\n')[0]
+        if len(first_line) > 80:
+            first_line = first_line[:77] + "..."
+    else:
+        first_line = "[No message content]"
+    
+    return first_line
+
+def request_message_text(request: Dict[str, Any]) -> str:
+    """Return the full text of a request's user message."""
+    message = request.get('message', {})
+    if isinstance(message, dict):
+        if 'text' in message:
+            return message['text']
+        elif 'parts' in message:
+            parts = message['parts']
+            if isinstance(parts, list):
+                return ''.join(part['text'] for part in parts if isinstance(part, dict) and 'text' in part)
+    return ""
+
+def summarize_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract the plain facts of a request, without rendering any markdown.
+
+    Returns the message and response text, model, timings, error message, the
+    tool calls shown in the response (with their arguments from the tool-call
+    rounds) and the files edited with their number of edits.
+    """
+    result = request.get('result')
+    if not isinstance(result, dict):
+        result = {}
+    timings = result.get('timings')
+    if not isinstance(timings, dict):
+        timings = {}
+    error_details = result.get('errorDetails')
+    metadata = result.get('metadata')
+    if not isinstance(metadata, dict):
+        metadata = {}
+
+    arguments_by_id = {}
+    tool_call_rounds = metadata.get('toolCallRounds')
+    if isinstance(tool_call_rounds, list):
+        for round_data in tool_call_rounds:
+            if isinstance(round_data, dict) and isinstance(round_data.get('toolCalls'), list):
+                for tool_call in round_data['toolCalls']:
+                    if isinstance(tool_call, dict) and 'id' in tool_call:
+                        arguments = tool_call.get('arguments')
+                        if not isinstance(arguments, str):
+                            arguments = json.dumps(arguments)
+                        arguments_by_id[tool_call['id']] = arguments
+
+    response_texts = []
+    tool_calls = []
+    file_edits = []
+    response = request.get('response')
+    for part in extract_response_parts(response if isinstance(response, list) else []):
+        if isinstance(part, TextPart):
+            response_texts.append(part.text)
+        elif isinstance(part, ToolInvocationPart):
+            data = part.data
+            message = data.get('pastTenseMessage') or data.get('invocationMessage') or ''
+            if isinstance(message, dict):
+                message = message.get('value', '')
+            call_id = data.get('toolCallId')
+            tool_calls.append({'id': call_id, 'tool': data.get('toolId'), 'message': message,
+                               'arguments': arguments_by_id.get(call_id)})
+        elif isinstance(part, TextEditGroupPart):
+            uri = part.data.get('uri')
+            if not isinstance(uri, dict):
+                uri = {}
+            edits = part.data.get('edits')
+            edit_count = sum(len(group) for group in edits if isinstance(group, list)) if isinstance(edits, list) else 0
+            file_edits.append({'path': uri.get('fsPath') or uri.get('path') or '', 'edits': edit_count})
+
+    return {
+        'request_id': request.get('requestId'),
+        'timestamp': request.get('timestamp'),
+        'model': request.get('modelId') or None,
+        'details': request.get('details') or result.get('details') or None,
+        'message': request_message_text(request),
+        'response': '\n\n'.join(response_texts),
+        'first_progress_ms': timings.get('firstProgress'),
+        'elapsed_ms': timings.get('totalElapsed'),
+        'error': error_details.get('message') if isinstance(error_details, dict) else None,
+        'tool_calls': tool_calls,
+        'file_edits': file_edits,
+    }
+
+class ChatRequest:
+    """The rendered content of a request, extracted from its dict in one pass.
+
+    Holds only what format_request shows, so large metadata that is never
+    rendered (rendered prompts, results of tools other than read_file, code
+    citations) is dropped with the dict, and repeated strings are interned.
+    `parts` is None for a request without a response; `error_details` is set
+    only when the request failed with a message.
+    """
+    __slots__ = ('message_text', 'preview', 'has_assistant', 'references', 'parts', 'round_responses',
+                 'tool_call_results', 'read_calls', 'error_details', 'elapsed_s', 'model_id', 'details')
+
+    def __init__(self):
+        self.message_text = ""
+        self.preview = ""
+        self.has_assistant = False
+        self.references = []
+        self.parts = None
+        self.round_responses = []
+        self.tool_call_results = {}
+        # index_read_calls() of the request, built only when it has tool invocations or edits
+        self.read_calls = None
+        self.error_details = None
+        self.elapsed_s = None
+        self.model_id = ''
+        self.details = ''
+
+    @classmethod
+    def from_dict(cls, request: Dict[str, Any]) -> 'ChatRequest':
+        self = cls()
+        self.message_text = request_message_text(request)
+        self.preview = request_preview(request)
+
+        response = request.get('response', [])
+        result = request.get('result', {})
+        metadata = None
+        if isinstance(result, dict):
+            error_details = result.get('errorDetails', {})
+            if error_details and isinstance(error_details, dict) and error_details.get('message'):
+                self.error_details = error_details
+            metadata = result.get('metadata', {})
+            if not isinstance(metadata, dict):
+                metadata = None
+            timings = result.get('timings', {})
+            if 'totalElapsed' in timings:
+                self.elapsed_s = timings['totalElapsed'] / 1000
+
+        # References and response are only shown in an Assistant section
+        self.has_assistant = bool(response or self.error_details is not None)
+        if self.has_assistant:
+            variable_data = request.get('variableData', {})
+            if isinstance(variable_data, dict):
+                variables = variable_data.get('variables', [])
+                if variables:
+                    self.references = [Reference.from_dict(variable) for variable in variables]
+
+        if response:
+            tool_call_rounds = metadata.get('toolCallRounds', []) if metadata is not None else []
+            # The consolidated response texts of the tool-call rounds
+            if isinstance(tool_call_rounds, list):
+                for round_data in tool_call_rounds:
+                    if isinstance(round_data, dict) and 'response' in round_data:
+                        round_response = round_data['response']
+                        if isinstance(round_response, str) and round_response.strip():
+                            self.round_responses.append(round_response.strip())
+
+            self.parts = extract_response_parts(response)
+            if any(isinstance(part, (ToolInvocationPart, TextEditGroupPart)) for part in self.parts):
+                tool_call_results = metadata.get('toolCallResults', {}) if metadata is not None else {}
+                self.read_calls = index_read_calls(tool_call_results, tool_call_rounds)
+                self.tool_call_results = _read_call_results(tool_call_results, self.read_calls[1])
+
+        self.model_id = _intern(request.get('modelId', ''))
+        self.details = _intern(request.get('details', ''))
+        return self
+
+
+def _read_call_results(tool_call_results: Any, reads_by_path: Dict[str, List[Tuple[int, int, Any]]]) -> Any:
+    """Keep only the text of indexed read_file call results, the only ones shown."""
+    if not isinstance(tool_call_results, collections.abc.Mapping):
+        return tool_call_results
+    return {tool_call_id: ToolResult(tool_result_texts(tool_call_results[tool_call_id]))
+            for reads in reads_by_path.values() for _, _, tool_call_id in reads
+            if isinstance(tool_call_id, str) and tool_call_id in tool_call_results}
+
+
+class ChatSession:
+    """A decoded chat export as its header fields and ChatRequest models."""
+    __slots__ = ('header', 'requests')
+
+    def __init__(self, header: Dict[str, Any], requests: List[ChatRequest]):
+        self.header = header
+        self.requests = requests
+
+    @classmethod
+    def from_dict(cls, chat_data: Dict[str, Any], consume: bool = False) -> 'ChatSession':
+        """Build the models of every request of a decoded export.
+
+        With `consume`, each request dict of a requests list is replaced by
+        its model as soon as it is built, so the decoded export's memory is
+        released request by request; the caller must not use it afterwards.
+        """
+        header = {key: value for key, value in chat_data.items() if key != 'requests'}
+        requests = chat_data.get('requests', [])
+        if consume and type(requests) is list:
+            for i, request in enumerate(requests):
+                requests[i] = ChatRequest.from_dict(request)
+            return cls(header, requests)
+        return cls(header, [ChatRequest.from_dict(request) for request in requests])
+
+    def previews(self) -> List[str]:
+        return [request.preview for request in self.requests]
+
+def _local_href(target: Optional[int]) -> str:
+    """Link to request `target` (or the Table of Contents for None) in the same file."""
+    return '#table-of-contents' if target is None else f'#request-{target}'
+
+def format_chat_header(chat_data: Dict[str, Any], previews: List[str], href: Callable[[Optional[int]], str] = None) -> List[str]:
+    """Format the document header and Table of Contents as markdown lines."""
+    href = href or _local_href
     md_lines = []
     
     # Header
@@ -767,285 +1389,2702 @@ def parse_chat_log(chat_data: Dict[str, Any]) -> str:
     md_lines.append("")
     
     # Generate table of contents
-    requests = chat_data.get('requests', [])
-    if len(requests) > 1:
+    if len(previews) > 1:
         md_lines.append('<a name="table-of-contents"></a>')
         md_lines.append("## Table of Contents")
         md_lines.append("")
-        for i, request in enumerate(requests, 1):
-            # Extract first line of user message for preview
-            message = request.get('message', {})
-            preview = ""
-            if isinstance(message, dict):
-                if 'text' in message:
-                    preview = message['text']
-                elif 'parts' in message:
-                    parts = message['parts']
-                    if isinstance(parts, list):
-                        for part in parts:
-                            if isinstance(part, dict) and 'text' in part:
-                                preview = part['text']
-                                break
-            
-            # Get first line for preview (limit to 80 chars)
-            if preview:
-                first_line = preview.split('\n')[0]
-                if len(first_line) > 80:
-                    first_line = first_line[:77] + "..."
-            else:
-                first_line = "[No message content]"
-            
-            md_lines.append(f"- [Request {i}](#request-{i}): {first_line}")
+        for i, first_line in enumerate(previews, 1):
+            md_lines.append(f"- [Request {i}]({href(i)}): {first_line}")
         
         md_lines.append("")
     
     md_lines.append("---")
     md_lines.append("")
     
-    # Process requests
-    requests = chat_data.get('requests', [])
+    return md_lines
+
+def format_request_heading(i: int, total: int, href: Callable[[Optional[int]], str] = None) -> str:
+    """Format the heading of request i (1-based) of total, with navigation links.
+
+    `href` builds the link to a request number, or to the Table of Contents
+    for None; by default all links point into the same file.
+    """
+    href = href or _local_href
+    # User message with navigation links on same line
+    nav_links = []
+    nav_links.append(f"[^]({href(None)})")  # Up to table of contents
+
+    if i > 1:  # Previous request link
+        nav_links.append(f"[<]({href(i - 1)})")
+    else:
+        nav_links.append("<")  # Placeholder for first request
+
+    if i < total:  # Next request link
+        nav_links.append(f"[>]({href(i + 1)})")
+    else:
+        nav_links.append(">")  # Placeholder for last request
+
+    return f"## Request {i} {' '.join(nav_links)}"
+
+def format_request(request: Union[ChatRequest, Dict[str, Any]], i: int, total: int, options: RenderOptions = None,
+                   href: Callable[[Optional[int]], str] = None, store: ContentStore = None) -> List[str]:
+    """Format request number i (1-based) of total as markdown lines.
+
+    `request` is a ChatRequest, or a request dict to build one from.
+    """
+    if not isinstance(request, ChatRequest):
+        request = ChatRequest.from_dict(request)
+    md_lines = []
+    if store is not None:
+        store.begin_request(i)
     
-    for i, request in enumerate(requests, 1):
-        # User message with navigation links on same line
-        nav_links = []
-        nav_links.append("[^](#table-of-contents)")  # Up to table of contents
-        
-        if i > 1:  # Previous request link
-            nav_links.append(f"[<](#request-{i-1})")
-        else:
-            nav_links.append("<")  # Placeholder for first request
-            
-        if i < len(requests):  # Next request link
-            nav_links.append(f"[>](#request-{i+1})")
-        else:
-            nav_links.append(">")  # Placeholder for last request
-        
-        # Add explicit anchor and header with navigation
-        md_lines.append(f'<a name="request-{i}"></a>')
-        md_lines.append(f"## Request {i} {' '.join(nav_links)}")
-        md_lines.append("")
-        
-        # Extract user message text
-        message = request.get('message', {})
-        message_text = ""
-        
-        if isinstance(message, dict):
-            if 'text' in message:
-                message_text = message['text']
-            elif 'parts' in message:
-                parts = message['parts']
-                if isinstance(parts, list):
-                    text_parts = []
-                    for part in parts:
-                        if isinstance(part, dict) and 'text' in part:
-                            text_parts.append(part['text'])
-                    message_text = ''.join(text_parts)
-        
-        if message_text:
-            md_lines.append("### Participant")
-            md_lines.append("")
-            md_lines.append(format_message_text(message_text))
-            md_lines.append("")
-        
-        # Assistant response
-        response = request.get('response', [])
-        result = request.get('result', {})
-        
-        # Check for error details
-        error_details = None
-        if isinstance(result, dict):
-            error_details = result.get('errorDetails', {})
-        
-        # Process assistant responses (can have both response content and errors)
-        if response or (error_details and isinstance(error_details, dict) and error_details.get('message')):
-            md_lines.append("### Assistant")
-            md_lines.append("")
-            
-            # Add references if they exist (might be present even with errors)
-            variable_data = request.get('variableData', {})
-            if isinstance(variable_data, dict):
-                variables = variable_data.get('variables', [])
-                if variables:
-                    references_formatted = format_references(variables)
-                    if references_formatted.strip():
-                        md_lines.append(references_formatted)
-            
-            # Process normal response content first (if any)
-            if response:
-                # First try to get consolidated response from toolCallRounds (like bash script)
-                consolidated_response = ""
-                if isinstance(result, dict):
-                    metadata = result.get('metadata', {})
-                    if isinstance(metadata, dict):
-                        tool_call_rounds = metadata.get('toolCallRounds', [])
-                        if isinstance(tool_call_rounds, list):
-                            tool_responses = []
-                            all_tool_calls = []
-                            
-                            for round_data in tool_call_rounds:
-                                if isinstance(round_data, dict):
-                                    # Skip collecting tool calls - we'll get them from the detailed response parts
-                                    # Collect response from this round
-                                    if 'response' in round_data:
-                                        round_response = round_data['response']
-                                        if isinstance(round_response, str) and round_response.strip():
-                                            tool_responses.append(round_response.strip())
-                            
-                            # Don't format tool calls here - they'll be handled by the detailed response processing
-                            
-                            # Add consolidated responses
-                            if tool_responses:
-                                consolidated_response = '\n'.join(tool_responses)
-                
-                # If no consolidated response available, fall back to incremental response parts
-                if not consolidated_response.strip():
-                    response_parts = []
-                    for part in response:
-                        part_text = extract_text_from_response_part(part)
-                        if part_text and part_text.strip():
-                            response_parts.append(part_text)
-                    
-                    if response_parts:
-                        consolidated_response = '\n'.join(response_parts)
-                
-                # Always process the incremental response parts for tool details, even if we have consolidated response
-                response_parts = []
-                for part in response:
-                    part_text = extract_text_from_response_part(part)
-                    if part_text and part_text.strip():
-                        response_parts.append(part_text)
-                
-                # Extract tool call results for this request
-                tool_call_results = {}
-                tool_call_rounds = []
-                if isinstance(result, dict):
-                    metadata = result.get('metadata', {})
-                    if isinstance(metadata, dict):
-                        tool_call_results = metadata.get('toolCallResults', {})
-                        tool_call_rounds = metadata.get('toolCallRounds', [])
-                
-                if response_parts:
-                    incremental_response = '\n'.join(response_parts)
-                    # Process special markers for tool invocations with tool call results
-                    incremental_response = process_special_markers(incremental_response, tool_call_results, tool_call_rounds)
-                    
-                    # Use the incremental response if it has more detail, otherwise use consolidated
-                    if ('__TOOL_INVOCATION__' in '\n'.join(response_parts) or 
-                        '__TEXT_EDIT_GROUP__' in '\n'.join(response_parts) or 
-                        not consolidated_response.strip()):
-                        consolidated_response = incremental_response
-                
-                # Use whichever response has more meaningful content
-                if consolidated_response.strip():
-                    cleaned_response = format_message_text(consolidated_response)
-                    if cleaned_response.strip():
-                        md_lines.append(cleaned_response)
-                        md_lines.append("")
-            
-            # Add error message if request failed (after any response content)
-            if error_details and isinstance(error_details, dict) and error_details.get('message'):
-                error_message = format_error_message(error_details)
-                if error_message.strip():
-                    md_lines.append(error_message)
-                    md_lines.append("")
-        
-        # Add timestamp and metadata if available
-        metadata_lines = []
-        
-        # Add timing information
-        if isinstance(result, dict):
-            timings = result.get('timings', {})
-            if 'totalElapsed' in timings:
-                elapsed_ms = timings['totalElapsed']
-                elapsed_s = elapsed_ms / 1000
-                metadata_lines.append(f"> *Response time: {elapsed_s:.2f} seconds*")
-        
-        # Add model information
-        model_id = request.get('modelId', '')
-        details = request.get('details', '')
-        
-        if model_id or details:
-            model_info_parts = []
-            if model_id:
-                # Clean up the model ID for display
-                if model_id.startswith('copilot/'):
-                    model_display = model_id[8:]  # Remove 'copilot/' prefix
+    # Add explicit anchor and header with navigation
+    md_lines.append(f'<a name="request-{i}"></a>')
+    md_lines.append(format_request_heading(i, total, href))
+    md_lines.append("")
+
+    message_text = request.message_text
+
+    if message_text:
+        md_lines.append("### Participant")
+        md_lines.append("")
+        md_lines.append(format_message_text(message_text))
+        md_lines.append("")
+
+    # Process assistant responses (can have both response content and errors)
+    if request.has_assistant:
+        md_lines.append("### Assistant")
+        md_lines.append("")
+
+        # Add references if they exist (might be present even with errors)
+        if request.references:
+            references_formatted = format_references(request.references)
+            if references_formatted.strip():
+                md_lines.append(references_formatted)
+
+        # Process normal response content first (if any)
+        response_parts = request.parts
+        if response_parts is not None:
+            # First use the consolidated responses of the tool-call rounds (like bash script)
+            response_texts = request.round_responses
+
+            # If no consolidated response available, fall back to the text of the raw
+            # response parts; special parts are only shown once rendered below
+            if not response_texts and response_parts:
+                response_texts = [part.text for part in response_parts if isinstance(part, TextPart)]
+
+            # Use the rendered parts if they have tool details, otherwise use consolidated
+            if request.read_calls is not None:
+                tool_index = ToolCallIndex(request.tool_call_results, options=options, store=store,
+                                           read_calls=request.read_calls)
+                response_texts = render_response_texts(response_parts, tool_index, options)
+
+            # Use whichever response has more meaningful content; the texts are
+            # formatted line by line rather than joined into one string first
+            cleaned_response = format_message_lines(response_texts)
+            if cleaned_response:
+                md_lines.append(cleaned_response)
+                md_lines.append("")
+
+        # Add error message if request failed (after any response content)
+        if request.error_details is not None:
+            error_message = format_error_message(request.error_details)
+            if error_message.strip():
+                md_lines.append(error_message)
+                md_lines.append("")
+
+    # Add timestamp and metadata if available
+    metadata_lines = []
+
+    # Add timing information
+    if request.elapsed_s is not None:
+        metadata_lines.append(f"> *Response time: {request.elapsed_s:.2f} seconds*")
+
+    # Add model information
+    model_id = request.model_id
+    details = request.details
+
+    if model_id or details:
+        model_info_parts = []
+        model_display = ''
+        if model_id:
+            # Clean up the model ID for display
+            if model_id.startswith('copilot/'):
+                model_display = model_id[8:]  # Remove 'copilot/' prefix
+            else:
+                model_display = model_id
+            model_info_parts.append(model_display)
+
+        if details and details != model_display:
+            model_info_parts.append(details)
+
+        if model_info_parts:
+            model_info = ' • '.join(model_info_parts)
+            metadata_lines.append(f"> <br>*Model: {model_info}*")
+
+    # Add all metadata lines
+    if metadata_lines:
+        for line in metadata_lines:
+            md_lines.append(line)
+        md_lines.append("")
+
+    # Add separator between requests
+    if i < total:
+        md_lines.append("---")
+        md_lines.append("")
+    
+    return md_lines
+
+# Requests rendered per worker task, enough to amortize the IPC of each task
+REQUESTS_PER_TASK = 8
+
+def _render_request_batch(task: Tuple[int, int, List[Dict[str, Any]], RenderOptions]) -> List[str]:
+    """Render a run of consecutive requests into their chunks (run in a worker process)."""
+    first, total, requests, options = task
+    return ['\n' + '\n'.join(format_request(request, i, total, options))
+            for i, request in enumerate(requests, first)]
+
+def _iter_request_batches(requests: Iterable[Dict[str, Any]], total: int, first: int,
+                          options: RenderOptions) -> Iterator[Tuple[int, int, List[Dict[str, Any]], RenderOptions]]:
+    batch = []
+    for i, request in enumerate(requests, first):
+        if i > total:
+            raise ValueError("Input changed while it was being converted")
+        batch.append(request)
+        if len(batch) == REQUESTS_PER_TASK:
+            yield i - len(batch) + 1, total, batch, options
+            batch = []
+    if batch:
+        yield i - len(batch) + 1, total, batch, options
+
+def render_requests(requests: Iterable[Dict[str, Any]], total: int, options: RenderOptions = None,
+                    jobs: int = None, first: int = 1, store: ContentStore = None,
+                    executor: concurrent.futures.Executor = None) -> Iterator[str]:
+    """Yield the markdown chunk of each request in order, starting at request number `first`.
+
+    With more than one job, runs of REQUESTS_PER_TASK requests are rendered
+    by a pool of worker processes. Only a few runs per worker are in flight at
+    a time, so a streamed input is still consumed gradually; the chunks are
+    the same as when rendering serially. A running `executor` is used instead
+    of starting a new pool. Deduplication needs to see every request in
+    order, so with `options.dedupe` requests are always rendered here,
+    recording shown blocks in `store` (a new one by default).
+    """
+    if options is not None and options.dedupe:
+        jobs = 1
+        if store is None:
+            store = ContentStore()
+    if not jobs or jobs == 1:
+        for i, request in enumerate(requests, first):
+            if i > total:
+                raise ValueError("Input changed while it was being converted")
+            yield '\n' + '\n'.join(format_request(request, i, total, options, store=store))
+        return
+
+    with contextlib.ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=jobs))
+        in_flight = collections.deque()
+        for task in _iter_request_batches(requests, total, first, options):
+            in_flight.append(executor.submit(_render_request_batch, task))
+            if len(in_flight) >= jobs * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+def iter_markdown_chunks(header: Dict[str, Any], previews: List[str], requests: Iterable[Dict[str, Any]],
+                         options: RenderOptions = None, jobs: int = None,
+                         executor: concurrent.futures.Executor = None) -> Iterator[str]:
+    """Render the document piece by piece: the header first, then each request.
+
+    Concatenating the chunks gives the complete markdown document. `previews`
+    holds the Table of Contents line of every request, so its length is the
+    request count. With `jobs`, requests are rendered in worker processes.
+    """
+    yield '\n'.join(format_chat_header(header, previews))
+    
+    # Process requests
+    yield from render_requests(requests, len(previews), options, jobs, executor=executor)
+
+def iter_chat_markdown(chat_data: Dict[str, Any], options: RenderOptions = None, jobs: int = None,
+                       executor: concurrent.futures.Executor = None) -> Iterator[str]:
+    """Render a decoded chat log as a sequence of markdown chunks."""
+    requests = chat_data.get('requests', [])
+    return iter_markdown_chunks(chat_data, [request_preview(request) for request in requests], requests, options,
+                                jobs, executor)
+
+def parse_chat_log(chat_data: Dict[str, Any], options: RenderOptions = None, jobs: int = None) -> str:
+    """Parse the chat log JSON and convert to markdown."""
+    return ''.join(iter_chat_markdown(chat_data, options, jobs))
+
+def _write_chunk(out: TextIO, chunk: str) -> None:
+    """Write one markdown chunk to a text stream."""
+    out.write(chunk)
+
+def write_markdown(chunks: Iterable[str], out: TextIO) -> None:
+    """Write markdown chunks to a text stream as soon as each one is rendered."""
+    for chunk in chunks:
+        _write_chunk(out, chunk)
+
+
+def sanitize_surrogates(text: str) -> str:
+    """Replace lone Unicode surrogates (U+D800-U+DFFF) that can't be encoded in UTF-8.
+
+    These can appear when VS Code exports chat containing certain emoji/braille art
+    characters that get serialized as unpaired surrogates in the JSON.
+    """
+    try:
+        # Cheap probe: text without lone surrogates always encodes
+        text.encode('utf-8')
+        return text
+    except UnicodeEncodeError:
+        return _LONE_SURROGATE.sub('\ufffd', text)
+
+
+_LONE_SURROGATE = re.compile('[\ud800-\udfff]')
+
+# A \uD800-\uDFFF escape in JSON text; group 1 is set for a high (leading) surrogate
+_SURROGATE_ESCAPE = re.compile(r'\\u[dD](?:([89abAB])|[c-fC-F])[0-9a-fA-F]{2}')
+_SURROGATE_ESCAPE_BYTES = re.compile(_SURROGATE_ESCAPE.pattern.encode())
+
+# Same length as the six-character escape it replaces
+_REPLACEMENT_ESCAPE = '\\ufffd'
+
+
+def _lone_surrogate_escapes(text: Any, pattern: 're.Pattern') -> Iterator[int]:
+    """Offsets of the escaped lone surrogates in JSON text (str, bytes or a mapping).
+
+    json decodes them into strings that can't be encoded as UTF-8; escaped
+    surrogate pairs (emoji) and escaped backslashes followed by "u" are not
+    matched.
+    """
+    backslash = '\\' if isinstance(text, str) else b'\\'
+    pair_end = 0
+    for match in pattern.finditer(text):
+        start = match.start()
+        if start < pair_end:
+            # The low half of a pair
+            continue
+        # Only an escape if not preceded by an odd number of backslashes
+        run = start
+        while run and text[run - 1:run] == backslash:
+            run -= 1
+        if (start - run) % 2:
+            continue
+        if match.group(1):
+            following = pattern.match(text, match.end())
+            if following and not following.group(1):
+                pair_end = following.end()
+                continue
+        yield start
+
+
+def fix_lone_surrogate_escapes(text: str) -> str:
+    """Replace escaped lone surrogates in JSON text with an escaped U+FFFD.
+
+    Text without them is returned as is, without a copy.
+    """
+    pieces = []
+    last = 0
+    for start in _lone_surrogate_escapes(text, _SURROGATE_ESCAPE):
+        pieces.append(text[last:start])
+        pieces.append(_REPLACEMENT_ESCAPE)
+        last = start + len(_REPLACEMENT_ESCAPE)
+    if not pieces:
+        return text
+    pieces.append(text[last:])
+    return ''.join(pieces)
+
+
+def _fix_lone_surrogate_escape_bytes(data: bytes) -> bytes:
+    """fix_lone_surrogate_escapes for UTF-8 bytes (or a mapping of them).
+
+    Replacements are written in place into a single copy, made only if a lone
+    escape is found.
+    """
+    fixed = None
+    for start in _lone_surrogate_escapes(data, _SURROGATE_ESCAPE_BYTES):
+        if fixed is None:
+            fixed = bytearray(data)
+        fixed[start:start + len(_REPLACEMENT_ESCAPE)] = _REPLACEMENT_ESCAPE.encode()
+    return data if fixed is None else fixed
+
+
+def sanitize_chat_text(text: str) -> str:
+    """Replace lone surrogates in chat export text, raw or escaped, ready for JSON decoding."""
+    return fix_lone_surrogate_escapes(sanitize_surrogates(text))
+
+
+# Characters read from the input per chunk when streaming
+STREAM_CHUNK_SIZE = 1 << 20
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_JSON_SCALAR_END = re.compile(r'[,\]} \t\n\r]')
+
+
+def _decode_json_text(text: str) -> Any:
+    """Decode JSON text from an already surrogate-sanitized buffer."""
+    return json.loads(fix_lone_surrogate_escapes(text))
+
+
+class LazyJSONArray(collections.abc.Sequence):
+    """A JSON array kept as raw text until an element is first accessed."""
+    __slots__ = ('_text', '_items')
+
+    def __init__(self, text: str):
+        self._text = text
+        self._items = None
+
+    def _decoded(self) -> List[Any]:
+        if self._items is None:
+            self._items = _decode_json_text(self._text)
+            self._text = None
+        return self._items
+
+    def __getitem__(self, index):
+        return self._decoded()[index]
+
+    def __len__(self) -> int:
+        return len(self._decoded())
+
+
+@functools.lru_cache(maxsize=None)
+def _member_key_pattern(indent: int) -> 're.Pattern':
+    """Match the keys of an object's members written at the given indentation."""
+    return re.compile('\n' + ' ' * indent + r'("(?:[^"\\]|\\.)*"): ')
+
+
+class LazyJSONObject(collections.abc.Mapping):
+    """A pretty-printed JSON object whose member values are decoded on first access.
+
+    The members are found by their indentation (`indent`, the column of the
+    opening brace, plus one `json_indent` step), so looking up one key costs
+    decoding only that member's value. Used for toolCallResults, where most
+    results are never shown.
+    """
+    __slots__ = ('_text', '_indent', '_json_indent', '_spans', '_values')
+
+    def __init__(self, text: str, indent: int, json_indent: int = 2):
+        self._text = text
+        self._indent = indent
+        self._json_indent = json_indent
+        # key -> (start, end) of the raw value, found on first use
+        self._spans = None
+        self._values = {}
+
+    def _members(self) -> Dict[str, Tuple[int, int]]:
+        if self._spans is None:
+            text = self._text
+            starts = [(_decode_json_text(match.group(1)), match.end(), match.start())
+                      for match in _member_key_pattern(self._indent + self._json_indent).finditer(text)]
+            spans = {}
+            for index, (key, start, _) in enumerate(starts):
+                end = starts[index + 1][2] if index + 1 < len(starts) else text.rindex('\n')
+                spans[key] = (start, text.rindex(',', start, end) if index + 1 < len(starts) else end)
+            self._spans = spans
+        return self._spans
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        start, end = self._members()[key]
+        value = self._values[key] = _decode_json_text(self._text[start:end])
+        return value
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._members()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._members())
+
+    def __len__(self) -> int:
+        return len(self._members())
+
+
+# Request metadata fields left undecoded by a lazy ChatExportStream; they sit
+# at result.metadata, three levels below the request
+_LAZY_FIELDS = ('toolCallResults', 'renderedUserMessage', 'renderedGlobalContext')
+_LAZY_FIELD_DEPTH = 3
+
+# Stands in for a skipped field while the rest of the request is decoded
+_LAZY_PLACEHOLDER = '\x00lazy'
+
+
+@functools.lru_cache(maxsize=None)
+def _lazy_field_pattern(field_indent: int) -> 're.Pattern':
+    """Match a lazy field's key at the given indentation, up to its opening bracket."""
+    names = '|'.join(_LAZY_FIELDS)
+    return re.compile('\n' + ' ' * field_indent + f'"({names})": ([\\[{{])')
+
+
+def decode_request_lazily(text: str, indent: int, json_indent: int = 2) -> Optional[Dict[str, Any]]:
+    """Decode the pretty-printed text of a request, leaving its bulky metadata raw.
+
+    `indent` is the column of the request's opening brace. Returns None when
+    the text isn't laid out as expected, for the caller to decode it fully.
+    """
+    field_indent = indent + _LAZY_FIELD_DEPTH * json_indent
+    pattern = _lazy_field_pattern(field_indent)
+    lazy = {}
+    last = 0
+    while True:
+        # Searching on from the end of each skipped value never scans its text twice
+        match = pattern.search(text, last)
+        if match is None:
+            break
+        name = match.group(1)
+        start = match.start(2)
+        if text[start + 1] in ']}':
+            # Empty and written on one line; cheap to decode as it is
+            last = match.end()
+            continue
+        closer = '\n' + ' ' * field_indent + (']' if match.group(2) == '[' else '}')
+        end = text.find(closer, start)
+        if name in lazy or end < 0:
+            return None
+        end += len(closer)
+        lazy[name] = (start, end)
+        last = end
+    if not lazy:
+        return _decode_json_text(text)
+
+    pieces = []
+    last = 0
+    for start, end in lazy.values():
+        pieces.append(text[last:start])
+        pieces.append(json.dumps(_LAZY_PLACEHOLDER))
+        last = end
+    pieces.append(text[last:])
+    request = _decode_json_text(''.join(pieces))
+    result = request.get('result') if isinstance(request, dict) else None
+    metadata = result.get('metadata') if isinstance(result, dict) else None
+    # A field of the same name elsewhere at that depth leaves a placeholder
+    # outside result.metadata; such requests are decoded in full
+    if not isinstance(metadata, dict) or any(metadata.get(name) != _LAZY_PLACEHOLDER for name in lazy):
+        return None
+    for name, (start, end) in lazy.items():
+        raw = text[start:end]
+        if raw.startswith('{'):
+            metadata[name] = LazyJSONObject(raw, field_indent, json_indent)
+        else:
+            metadata[name] = LazyJSONArray(raw)
+    return request
+
+
+class ChatExportStream:
+    """Incrementally decode a chat export, one element of 'requests' at a time.
+
+    Top-level fields other than 'requests' are collected into `header` as they
+    are reached, so the header is only complete once iteration has finished.
+    Only the element being decoded and one read chunk are held in memory.
+
+    With `lazy`, the toolCallResults, renderedUserMessage and
+    renderedGlobalContext of each request are kept as raw text and only
+    decoded when accessed (see decode_request_lazily). This relies on the
+    indentation of pretty-printed exports; other input is decoded in full.
+    """
+
+    def __init__(self, stream: TextIO, chunk_size: int = STREAM_CHUNK_SIZE, lazy: bool = False):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.lazy = lazy
+        self.header = {}
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _read_more(self, min_size: int = 0) -> bool:
+        """Append the next chunk of input to the buffer; False at end of input."""
+        if self._eof:
+            return False
+        # Drop the already-consumed prefix before growing the buffer
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        chunk = self.stream.read(max(self.chunk_size, min_size))
+        if not chunk:
+            self._eof = True
+            return False
+        # Sanitize any lone surrogates before JSON parsing
+        self._buf += sanitize_surrogates(chunk)
+        return True
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character ('' at end of input)."""
+        while True:
+            self._pos = _JSON_WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read_more():
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        """Consume one of the given structural characters and return it."""
+        ch = self._peek()
+        if not ch or ch not in chars:
+            expected = ' or '.join(repr(c) for c in chars)
+            raise json.JSONDecodeError(f"Expecting {expected}", self._buf, self._pos)
+        self._pos += 1
+        return ch
+
+    def _decode_value(self) -> Any:
+        """Decode the next complete JSON value, reading more input as needed."""
+        if self._peek() not in '{["':
+            # Numbers and literals are only complete once a delimiter follows them
+            while not _JSON_SCALAR_END.search(self._buf, self._pos) and self._read_more():
+                pass
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # Probably cut off mid-value; at least double what is buffered
+                if not self._read_more(len(self._buf) - self._pos):
+                    raise
+                continue
+            # Only values whose text escapes a lone surrogate are decoded again
+            if _SURROGATE_ESCAPE.search(self._buf, self._pos, end):
+                text = self._buf[self._pos:end]
+                fixed = fix_lone_surrogate_escapes(text)
+                if fixed is not text:
+                    value = json.loads(fixed)
+            self._pos = end
+            return value
+
+    def _decode_request(self) -> Any:
+        """Decode the next element of 'requests', lazily when possible."""
+        if not self.lazy or self._peek() != '{':
+            return self._decode_value()
+        line_start = self._buf.rfind('\n', 0, self._pos) + 1
+        indent = self._pos - line_start
+        if not indent or self._buf[line_start:self._pos].strip(' '):
+            # Not on a line of its own, so not pretty-printed
+            return self._decode_value()
+
+        # In pretty-printed JSON the closing brace is the first at the same indentation
+        closer = '\n' + ' ' * indent + '}'
+        searched = self._pos
+        while True:
+            end = self._buf.find(closer, searched)
+            if end >= 0:
+                break
+            # Only the tail could be the start of a closer cut off by the chunk boundary
+            searched = max(self._pos, len(self._buf) - len(closer))
+            searched -= self._pos
+            if not self._read_more(len(self._buf) - self._pos):
+                return self._decode_value()
+            searched += self._pos
+        end += len(closer)
+        try:
+            # The elements of 'requests' sit two indentation steps into the export
+            request = decode_request_lazily(self._buf[self._pos:end], indent, indent // 2)
+        except json.JSONDecodeError:
+            request = None
+        if request is None:
+            return self._decode_value()
+        self._pos = end
+        return request
+
+    def iter_requests(self) -> Iterator[Dict[str, Any]]:
+        """Yield each element of the top-level 'requests' array in order."""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+
+        while True:
+            if self._peek() != '"':
+                raise json.JSONDecodeError("Expecting property name enclosed in double quotes", self._buf, self._pos)
+            key = self._decode_value()
+            self._expect(':')
+
+            if key == 'requests' and self._peek() == '[':
+                self._pos += 1
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        request = self._decode_request()
+                        # Release the raw text of this element before handing it out
+                        if self._pos > self.chunk_size:
+                            self._buf = self._buf[self._pos:]
+                            self._pos = 0
+                        yield request
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self.header[key] = self._decode_value()
+
+            if self._expect(',}') == '}':
+                break
+
+        if self._peek():
+            raise json.JSONDecodeError("Extra data", self._buf, self._pos)
+
+
+# Path that stands for stdin (input) or stdout (output)
+STDIO_PATH = '-'
+
+# Stdlib codecs for compressed input and output paths, by file suffix
+COMPRESSION_BY_SUFFIX = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}
+
+# Raised while decompressing a truncated or corrupt input (bz2 raises a plain OSError)
+CORRUPT_COMPRESSION_ERRORS = (EOFError, gzip.BadGzipFile, lzma.LZMAError)
+
+# gzip's own default level: level 9 takes twice as long for files about 2% smaller
+_COMPRESS_OPTIONS = {gzip: {'compresslevel': 6}}
+
+
+def compression_for(path: str) -> Any:
+    """The gzip, bz2 or lzma module for a compressed path, or None."""
+    if path == STDIO_PATH:
+        return None
+    return COMPRESSION_BY_SUFFIX.get(os.path.splitext(path)[1].lower())
+
+
+def strip_compression_suffix(path: str) -> str:
+    """The path without its .gz, .bz2 or .xz suffix."""
+    return os.path.splitext(path)[0] if compression_for(path) else path
+
+
+@contextlib.contextmanager
+def open_chat_file(input_file: str) -> Iterator[TextIO]:
+    """Open a chat export for reading ('-' for stdin), allowing surrogates during decode.
+
+    Compressed exports are decompressed as they are read.
+    """
+    compression = compression_for(input_file)
+    if compression is not None:
+        with compression.open(input_file, 'rt', encoding='utf-8', errors='surrogatepass') as f:
+            yield f
+        return
+
+    if input_file != STDIO_PATH:
+        with open(input_file, 'r', encoding='utf-8', errors='surrogatepass') as f:
+            yield f
+        return
+
+    if not hasattr(sys.stdin, 'buffer'):
+        yield sys.stdin
+        return
+    f = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='surrogatepass')
+    try:
+        yield f
+    finally:
+        # Leave the underlying stdin open
+        f.detach()
+
+
+@contextlib.contextmanager
+def open_markdown_output(output_file: str) -> Iterator[TextIO]:
+    """Open a markdown output file for writing ('-' for stdout), compressed if its suffix asks for it.
+
+    A file is written under a temporary name and only replaces the output
+    once the block completes, so a conversion that fails part way leaves the
+    previous output as it was.
+    """
+    if output_file != STDIO_PATH:
+        temp_file = output_file + '.tmp'
+        compression = compression_for(output_file)
+        try:
+            if compression is not None:
+                out = compression.open(temp_file, 'wt', encoding='utf-8', errors='replace',
+                                       **_COMPRESS_OPTIONS.get(compression, {}))
+            else:
+                # Write the markdown file with replace fallback for safety
+                out = open(temp_file, 'w', encoding='utf-8', errors='replace')
+            with out:
+                yield out
+            os.replace(temp_file, output_file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        return
+
+    if not hasattr(sys.stdout, 'buffer'):
+        yield sys.stdout
+        return
+    sys.stdout.flush()
+    out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    try:
+        yield out
+    finally:
+        # Leave the underlying stdout open
+        out.flush()
+        out.detach()
+
+
+# Inputs at least this large are memory-mapped rather than read into memory
+MMAP_MIN_SIZE = 1 << 24
+
+
+def map_chat_file(f: BinaryIO) -> Optional[mmap.mmap]:
+    """Memory-map an open chat export read-only, or None if it is small or can't be mapped."""
+    try:
+        if os.fstat(f.fileno()).st_size < MMAP_MIN_SIZE:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Pipes, special files and some network filesystems can't be mapped
+        return None
+
+
+class MappedChatFile:
+    """A seekable text stream over a memory-mapped chat export.
+
+    Each read decodes only the requested slice of the mapping, so the whole
+    file is never copied into process memory; its pages stay in the OS cache,
+    shared with any other process reading the same file.
+    """
+
+    def __init__(self, mapping: mmap.mmap):
+        self._mapping = mapping
+        self._offset = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='surrogatepass')
+
+    def read(self, size: int = -1) -> str:
+        """Decode up to `size` more bytes of the mapping ('' at end of input)."""
+        length = len(self._mapping)
+        text = ''
+        while not text and self._offset < length:
+            end = length if size < 0 else min(self._offset + max(size, 1), length)
+            data = self._mapping[self._offset:end]
+            self._offset = end
+            text = self._decoder.decode(data, final=end == length)
+        return text
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._offset
+
+    def seek(self, offset: int) -> int:
+        self._offset = offset
+        self._decoder.reset()
+        return offset
+
+
+def decode_chat_bytes(data: bytes) -> str:
+    """Decode the UTF-8 bytes of a chat export (or a mapping of them), replacing any lone surrogates.
+
+    Lone surrogates written as JSON escapes are replaced too, so the text is
+    ready for decode_chat_json.
+    """
+    data = _fix_lone_surrogate_escape_bytes(data)
+    try:
+        # Almost all exports decode strictly, which also proves they hold no surrogates
+        return str(data, 'utf-8')
+    except UnicodeDecodeError:
+        # Allow surrogates during decode, then sanitize them before JSON parsing
+        return sanitize_surrogates(str(data, 'utf-8', 'surrogatepass'))
+
+
+def _read_chat_text(input_file: str) -> str:
+    """Read a whole chat export as text, with lone surrogates already replaced."""
+    compression = compression_for(input_file)
+    if compression is not None:
+        with compression.open(input_file, 'rb') as f:
+            return decode_chat_bytes(f.read())
+    if input_file != STDIO_PATH:
+        with open(input_file, 'rb') as f:
+            mapping = map_chat_file(f)
+            if mapping is None:
+                return decode_chat_bytes(f.read())
+            with mapping:
+                # Decode straight from the page cache, without a private copy of the bytes
+                return decode_chat_bytes(mapping)
+    if hasattr(sys.stdin, 'buffer'):
+        return decode_chat_bytes(sys.stdin.buffer.read())
+    return sanitize_chat_text(sys.stdin.read())
+
+
+def decode_chat_json(raw_text: str) -> Dict[str, Any]:
+    """Decode the JSON text of a chat export, as returned by decode_chat_bytes or sanitize_chat_text."""
+    return json.loads(raw_text)
+
+
+def read_chat_file(input_file: str) -> Dict[str, Any]:
+    """Read and decode a chat export JSON file."""
+    return decode_chat_json(_read_chat_text(input_file))
+
+
+# Bump when the decoded form of an export changes, to ignore old cache entries
+PARSE_CACHE_VERSION = 1
+
+DEFAULT_PARSE_CACHE_BYTES = 1 << 30
+
+
+@contextlib.contextmanager
+def _gc_paused() -> Iterator[None]:
+    """Suspend the cyclic garbage collector while building many containers at once."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class ParseCache:
+    """Directory of decoded chat exports stored with marshal, keyed by content hash.
+
+    Entry names include PARSE_CACHE_VERSION and the Python version, whose
+    marshal format they depend on. Each hit updates an entry's mtime; after
+    a new entry is written, the least recently used entries are removed until
+    the directory fits in `max_bytes`. Several processes may share a cache.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_PARSE_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def entry_path(self, content_hash: str) -> str:
+        version = f"v{PARSE_CACHE_VERSION}-py{sys.version_info[0]}{sys.version_info[1]}"
+        return os.path.join(self.directory, f"{content_hash}-{version}.marshal")
+
+    def read_chat_file(self, input_file: str) -> Dict[str, Any]:
+        """Like read_chat_file, but from the cache when this content was decoded before."""
+        if input_file == STDIO_PATH:
+            return read_chat_file(input_file)
+        with open(input_file, 'rb') as f:
+            mapping = map_chat_file(f)
+            data = f.read() if mapping is None else mapping
+            try:
+                path = self.entry_path(hashlib.sha1(data).hexdigest())
+                chat_data = self._load(path)
+                if chat_data is not None:
+                    return chat_data
+                compression = compression_for(input_file)
+                if compression is not None:
+                    data = compression.decompress(data)
+                chat_data = decode_chat_json(decode_chat_bytes(data))
+            finally:
+                if mapping is not None:
+                    mapping.close()
+        self._store(path, chat_data)
+        return chat_data
+
+    def _load(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # marshal.load on a file reads value by value; decoding the bytes is much faster
+            with _gc_paused():
+                chat_data = marshal.loads(data)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError):
+            # Truncated or foreign file; it is replaced below
+            return None
+        if not isinstance(chat_data, dict):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return chat_data
+
+    def _store(self, path: str, chat_data: Dict[str, Any]) -> None:
+        # A cache that can't be written only costs speed
+        try:
+            data = marshal.dumps(chat_data)
+        except ValueError:
+            return
+        if len(data) > self.max_bytes:
+            # Could never fit, so it isn't written only to be evicted
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            f = tempfile.NamedTemporaryFile('wb', dir=self.directory, delete=False, prefix='.', suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with f:
+                f.write(data)
+            os.replace(f.name, path)
+        except (OSError, ValueError):
+            with contextlib.suppress(OSError):
+                os.unlink(f.name)
+            return
+        self.evict(keep=path)
+
+    def evict(self, keep: str = None) -> None:
+        """Remove the least recently used entries until the cache fits its size budget.
+
+        `keep`, the entry just stored, is spared; _store only writes entries
+        that fit the budget on their own.
+        """
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.marshal') and entry.is_file():
+                        st = entry.stat()
+                        entries.append((st.st_mtime_ns, entry.path, st.st_size))
+                        total += st.st_size
+        except OSError:
+            return
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            with contextlib.suppress(OSError):
+                # Another process may have removed it already
+                os.unlink(path)
+            total -= size
+
+
+def request_hash(request: Dict[str, Any]) -> str:
+    """Content hash of a decoded request, independent of the input's formatting."""
+    return hashlib.sha1(json.dumps(request, sort_keys=True).encode('ascii')).hexdigest()
+
+
+# Bump when the state file layout or the rendered markdown changes
+INCREMENTAL_STATE_VERSION = 2
+
+
+def incremental_state_path(output_file: str) -> str:
+    """Path of the state file kept next to an incrementally updated output.
+
+    The name doesn't end in .json, so directories of exports that also hold
+    their markdown (as with `watch`) don't pick it up as an export.
+    """
+    return output_file + '.state'
+
+
+def _legacy_incremental_state_path(output_file: str) -> str:
+    """Where earlier versions kept the state file; read once and then replaced."""
+    return output_file + '.state.json'
+
+
+def _load_incremental_state(output_file: str, options: RenderOptions) -> Optional[Dict[str, Any]]:
+    """Load the state of a previous incremental run, if it still matches the output."""
+    state = None
+    for path in (incremental_state_path(output_file), _legacy_incremental_state_path(output_file)):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            break
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError):
+            return None
+    try:
+        size = os.path.getsize(output_file)
+    except OSError:
+        return None
+
+    if not isinstance(state, dict) or state.get('version') != INCREMENTAL_STATE_VERSION:
+        return None
+    # Requests rendered with other size limits have to be rendered again
+    if state.get('options') != options.to_dict():
+        return None
+    entries = state.get('requests', [])
+    # The output must not have been modified since the state was written
+    expected_size = entries[-1]['end'] if entries else state.get('body_start')
+    if size != expected_size:
+        return None
+    return state
+
+
+def _encode_chunk(chunk: str) -> bytes:
+    """Encode a markdown chunk the way a text-mode output file would store it."""
+    if os.linesep != '\n':
+        chunk = chunk.replace('\n', os.linesep)
+    return chunk.encode('utf-8', errors='replace')
+
+
+def _copy_bytes(src: BinaryIO, dst: BinaryIO, length: int) -> None:
+    """Copy exactly `length` bytes from the current position of src to dst."""
+    while length > 0:
+        block = src.read(min(length, STREAM_CHUNK_SIZE))
+        if not block:
+            raise ValueError("Existing output is shorter than its state file records")
+        dst.write(block)
+        length -= len(block)
+
+
+def write_incremental(header: Dict[str, Any], previews: List[str], hashes: List[str],
+                      requests: Iterable[Dict[str, Any]], output_file: str, options: RenderOptions = None,
+                      jobs: int = None) -> int:
+    """Update an output file, rendering only requests that are new or changed.
+
+    A state file next to the output records the content hash and byte range of
+    every rendered request. Requests up to the first changed one are copied
+    from the existing output unchanged; if the previous last request gained a
+    successor, only its [>] navigation link and separator are patched. The
+    header and Table of Contents are always rewritten. Returns the number of
+    requests that were rendered.
+    """
+    if options is None:
+        options = DEFAULT_RENDER_OPTIONS
+    state = _load_incremental_state(output_file, options)
+    store = ContentStore() if options.dedupe else None
+    old_entries = state['requests'] if state else []
+    old_total, total = len(old_entries), len(previews)
+
+    common = 0
+    while common < min(old_total, total) and old_entries[common]['hash'] == hashes[common]:
+        common += 1
+
+    if common == old_total == total:
+        reused = total
+    else:
+        # Requests that stay in the middle of the document keep their bytes
+        reused = max(0, min(common, old_total - 1, total - 1))
+    # The previous last request only needs its next link and separator
+    patch_last = 0 < old_total < total and common >= old_total
+
+    # Build the new output next to the old one, then swap it into place
+    temp_file = output_file + '.tmp'
+    entries = []
+    rendered = 0
+    try:
+        with open(temp_file, 'wb') as out:
+            offset = out.write(_encode_chunk('\n'.join(format_chat_header(header, previews))))
+            body_start = offset
+
+            if reused or patch_last:
+                with open(output_file, 'rb') as old:
+                    old.seek(old_entries[0]['start'])
+                    if reused:
+                        _copy_bytes(old, out, old_entries[reused - 1]['end'] - old_entries[0]['start'])
+                        shift = body_start - old_entries[0]['start']
+                        for entry in old_entries[:reused]:
+                            entries.append(dict(entry, start=entry['start'] + shift, end=entry['end'] + shift))
+                        offset = entries[-1]['end']
+                    if patch_last:
+                        entry = old_entries[old_total - 1]
+                        chunk = old.read(entry['end'] - entry['start']).decode('utf-8')
+                        chunk = chunk.replace(format_request_heading(old_total, old_total),
+                                              format_request_heading(old_total, total), 1)
+                        data = chunk.encode('utf-8') + _encode_chunk('\n---\n')
+                        out.write(data)
+                        entries.append(dict(entry, start=offset, end=offset + len(data)))
+                        offset += len(data)
+
+            done = len(entries)
+            if store is not None:
+                # Later requests may refer to blocks shown in the copied ones
+                for i, entry in enumerate(entries, 1):
+                    for key, number in entry.get('blocks', []):
+                        store.add(key, i, number)
+            requests = iter(requests)
+            for _ in itertools.islice(requests, done):
+                pass
+            chunks = render_requests(requests, total, options, jobs, first=done + 1, store=store)
+            for i, chunk in enumerate(chunks, done + 1):
+                data = _encode_chunk(chunk)
+                out.write(data)
+                entries.append({'hash': hashes[i - 1], 'start': offset, 'end': offset + len(data)})
+                if store is not None:
+                    entries[-1]['blocks'] = store.new_blocks()
+                offset += len(data)
+                rendered += 1
+
+        os.replace(temp_file, output_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+    with open(incremental_state_path(output_file), 'w', encoding='utf-8') as f:
+        json.dump({'version': INCREMENTAL_STATE_VERSION, 'options': options.to_dict(),
+                   'body_start': body_start, 'requests': entries}, f)
+    try:
+        os.remove(_legacy_incremental_state_path(output_file))
+    except FileNotFoundError:
+        pass
+    return rendered
+
+
+class ShardLayout:
+    """Which file of a sharded conversion holds each request.
+
+    The index file is the output file itself and holds the header and Table
+    of Contents; shard k is written next to it as `<stem>-00k.md`. With
+    `requests_per_shard` the layout is fixed up front; otherwise requests are
+    placed one by one with `assign`.
+    """
+
+    def __init__(self, output_file: str, requests_per_shard: int = None):
+        self.index_file = output_file
+        self.stem, self.ext = os.path.splitext(output_file)
+        self.ext = self.ext or '.md'
+        self.requests_per_shard = requests_per_shard
+        self._shards = {}
+
+    def shard_file(self, shard: int) -> str:
+        return f"{self.stem}-{shard:03d}{self.ext}"
+
+    def assign(self, i: int, shard: int) -> None:
+        self._shards[i] = shard
+
+    def shard_of(self, i: int, default: int = None) -> int:
+        if self.requests_per_shard:
+            return (i - 1) // self.requests_per_shard + 1
+        return self._shards.get(i, default)
+
+    def linked_shards(self) -> Set[int]:
+        """The shards the existing index file links to, i.e. those written by the previous run."""
+        link = re.compile(re.escape(os.path.basename(self.stem)) + r'-(\d{3,})' + re.escape(self.ext) + '#request-')
+        try:
+            with open(self.index_file, encoding='utf-8', errors='replace') as f:
+                return {int(shard) for shard in link.findall(f.read())}
+        except OSError:
+            return set()
+
+    def href(self, shard: int = None) -> Callable[[Optional[int]], str]:
+        """Link builder for the given shard file (None for the index file)."""
+        index_name = os.path.basename(self.index_file)
+
+        def href(target: Optional[int]) -> str:
+            if target is None:
+                return f"{index_name}#table-of-contents"
+            # Requests not placed yet are expected to stay in this shard
+            target_shard = self.shard_of(target, shard)
+            if target_shard == shard:
+                return f"#request-{target}"
+            return f"{os.path.basename(self.shard_file(target_shard))}#request-{target}"
+        return href
+
+
+def format_shard_header(layout: ShardLayout, first: int, last: int, total: int) -> List[str]:
+    """Format the top of a shard file, linking back to the index."""
+    return [
+        "# GitHub Copilot Chat Log",
+        "",
+        f"Requests {first}-{last} of {total} · [Table of Contents]({layout.href()(None)})",
+        "",
+        "---",
+        "",
+    ]
+
+
+def _write_file_if_changed(path: str, chunks: Iterable[str]) -> bool:
+    """Write markdown chunks to a file unless it already holds exactly that text."""
+    data = b''.join(_encode_chunk(chunk) for chunk in chunks)
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def _write_shard(task: Tuple[ShardLayout, int, int, int, List[Dict[str, Any]], RenderOptions]) -> bool:
+    """Render and write one shard of a fixed layout (run in a worker process)."""
+    layout, shard, first, total, requests, options = task
+    href = layout.href(shard)
+    # Duplicates are only referenced within the same shard
+    store = ContentStore() if options.dedupe else None
+    chunks = ['\n'.join(format_shard_header(layout, first, first + len(requests) - 1, total))]
+    for i, request in enumerate(requests, first):
+        chunks.append('\n' + '\n'.join(format_request(request, i, total, options, href, store)))
+    return _write_file_if_changed(layout.shard_file(shard), chunks)
+
+
+def _iter_fixed_shards(layout: ShardLayout, requests: Iterable[Dict[str, Any]], total: int,
+                       options: RenderOptions) -> Iterator[Tuple[ShardLayout, int, int, int, List[Dict[str, Any]], RenderOptions]]:
+    """Group requests into the shard tasks of a fixed layout."""
+    batch = []
+    shard = 1
+    for i, request in enumerate(requests, 1):
+        if i > total:
+            raise ValueError("Input changed while it was being converted")
+        batch.append(request)
+        if len(batch) == layout.requests_per_shard:
+            yield layout, shard, i - len(batch) + 1, total, batch, options
+            batch = []
+            shard += 1
+    if batch:
+        yield layout, shard, total - len(batch) + 1, total, batch, options
+
+
+def _write_byte_budget_shards(layout: ShardLayout, requests: Iterable[Dict[str, Any]], total: int,
+                              max_shard_bytes: int, options: RenderOptions, jobs: int = None) -> int:
+    """Place requests in order, starting a new shard when one would exceed the budget.
+
+    Returns the number of shards. Requests are rendered with local links (in
+    worker processes with `jobs`); each heading is rewritten for its file once
+    the shard of the following request is known.
+    """
+    shard = 1
+    first = 1
+    chunks = []
+    shard_bytes = 0
+    previous = None
+
+    def place(n: int, chunk: str) -> None:
+        heading = format_request_heading(n, total, layout.href(layout.shard_of(n)))
+        chunks.append(chunk.replace(format_request_heading(n, total), heading, 1))
+
+    def flush(last: int) -> None:
+        header = '\n'.join(format_shard_header(layout, first, last, total))
+        _write_file_if_changed(layout.shard_file(shard), [header] + chunks)
+
+    for i, chunk in enumerate(render_requests(requests, total, options, jobs), 1):
+        size = len(chunk.encode('utf-8', errors='replace'))
+        new_shard = shard_bytes and shard_bytes + size > max_shard_bytes
+        layout.assign(i, shard + 1 if new_shard else shard)
+        if previous is not None:
+            place(i - 1, previous)
+        if new_shard:
+            flush(i - 1)
+            shard += 1
+            first = i
+            chunks = []
+            shard_bytes = 0
+        previous = chunk
+        shard_bytes += size
+    if previous is None:
+        return 0
+    place(total, previous)
+    flush(total)
+    return shard
+
+
+def write_sharded(header: Dict[str, Any], previews: List[str], requests: Iterable[Dict[str, Any]], output_file: str,
+                  requests_per_shard: int = None, max_shard_bytes: int = None, jobs: int = None,
+                  options: RenderOptions = None) -> List[str]:
+    """Split the document into shard files plus an index file with the Table of Contents.
+
+    Shards hold `requests_per_shard` requests each, or as many as fit in
+    `max_shard_bytes` (at least one). Fixed-size shards are rendered and
+    written in parallel by `jobs` worker processes. Shard files whose content
+    is unchanged are not rewritten. Returns the paths of all written files,
+    the index first.
+    """
+    if not requests_per_shard and not max_shard_bytes:
+        raise ValueError("Sharding needs a number of requests or a byte budget per shard")
+    options = options or DEFAULT_RENDER_OPTIONS
+    if options.dedupe and not requests_per_shard:
+        raise ValueError("Deduplication needs shards of a fixed number of requests")
+    total = len(previews)
+    layout = ShardLayout(output_file, requests_per_shard)
+    previous = layout.linked_shards()
+
+    if requests_per_shard:
+        count = (total + requests_per_shard - 1) // requests_per_shard
+        tasks = _iter_fixed_shards(layout, requests, total, options)
+        jobs = jobs or os.cpu_count() or 1
+        if jobs == 1 or count <= 1:
+            for task in tasks:
+                _write_shard(task)
+        else:
+            # Submit a few shards per worker at a time, so only those are held in memory
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                pending = set()
+                for task in tasks:
+                    if len(pending) >= jobs * 2:
+                        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(executor.submit(_write_shard, task))
+                for future in concurrent.futures.as_completed(pending):
+                    future.result()
+    else:
+        count = _write_byte_budget_shards(layout, requests, total, max_shard_bytes, options, jobs)
+
+    _write_file_if_changed(output_file, ['\n'.join(format_chat_header(header, previews, layout.href()))])
+
+    # Remove shards left over from an earlier run that produced more of them;
+    # only those its index linked to, so unrelated files with a similar name stay
+    for stale in sorted(previous):
+        if stale > count and os.path.exists(layout.shard_file(stale)):
+            os.remove(layout.shard_file(stale))
+    return [output_file] + [layout.shard_file(shard) for shard in range(1, count + 1)]
+
+
+def convert_stream(f: TextIO, output_file: str, incremental: bool = False, options: RenderOptions = None,
+                   jobs: int = None, **sharding) -> None:
+    """Convert a seekable chat export stream, one request at a time.
+
+    The input is read twice: once to collect the header fields and the Table of
+    Contents previews, and once to render each request. Bulky metadata is
+    only decoded if a request uses it, except for the hashes of incremental
+    mode, which cover each whole request.
+    """
+    start = f.tell()
+    reader = ChatExportStream(f, lazy=not incremental)
+    previews = []
+    hashes = []
+    for request in reader.iter_requests():
+        previews.append(request_preview(request))
+        if incremental:
+            hashes.append(request_hash(request))
+
+    f.seek(start)
+    requests = ChatExportStream(f, lazy=True).iter_requests()
+    if sharding:
+        write_sharded(reader.header, previews, requests, output_file, jobs=jobs, options=options, **sharding)
+        return
+    if incremental:
+        write_incremental(reader.header, previews, hashes, requests, output_file, options, jobs)
+        return
+    with open_markdown_output(output_file) as out:
+        write_markdown(iter_markdown_chunks(reader.header, previews, requests, options, jobs), out)
+
+
+def convert_file_streaming(input_file: str, output_file: str, incremental: bool = False,
+                           options: RenderOptions = None, jobs: int = None, **sharding) -> None:
+    """Convert a chat export while holding only one request in memory at a time.
+
+    A compressed export is decompressed on the fly, once per pass.
+    """
+    if input_file != STDIO_PATH and compression_for(input_file) is None:
+        with open(input_file, 'rb') as f:
+            mapping = map_chat_file(f)
+            if mapping is not None:
+                with mapping:
+                    convert_stream(MappedChatFile(mapping), output_file, incremental, options, jobs, **sharding)
+                return
+
+    with open_chat_file(input_file) as f:
+        if f.seekable():
+            convert_stream(f, output_file, incremental, options, jobs, **sharding)
+            return
+
+        # A pipe can only be read once, so spool it to a temporary file first
+        with tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogatepass') as spool:
+            shutil.copyfileobj(f, spool)
+            spool.seek(0)
+            convert_stream(spool, output_file, incremental, options, jobs, **sharding)
+
+
+@contextlib.contextmanager
+def open_chat_stream(input_file: str, lazy: bool = True) -> Iterator[ChatExportStream]:
+    """Open a chat export ('-' for stdin) for a single streaming pass over its requests.
+
+    By default bulky request metadata is decoded only when accessed (see ChatExportStream).
+    """
+    if input_file != STDIO_PATH and compression_for(input_file) is None:
+        with open(input_file, 'rb') as f:
+            mapping = map_chat_file(f)
+            if mapping is not None:
+                with mapping:
+                    yield ChatExportStream(MappedChatFile(mapping), lazy=lazy)
+                return
+    with open_chat_file(input_file) as f:
+        yield ChatExportStream(f, lazy=lazy)
+
+
+def convert_file(input_file: str, output_file: str, stream: bool = False, incremental: bool = False,
+                 options: RenderOptions = None, shard_requests: int = None, shard_bytes: int = None,
+                 jobs: int = None, cache: ParseCache = None) -> None:
+    """Convert one chat export file to a markdown file ('-' for stdin/stdout).
+
+    With `incremental`, only requests that are new or changed since the last
+    incremental run on the same output file are rendered. `options` sets the
+    size limits of the rendered sections. With `shard_requests` or
+    `shard_bytes`, the output file becomes an index and the requests are split
+    over several files (see write_sharded). `jobs` is the number of worker
+    processes that render requests; by default requests are rendered in this
+    process, or by one worker per CPU when sharding by request count. A
+    `cache` keeps decoded exports, so converting the same content again
+    skips JSON decoding; it isn't used with `stream`. Paths ending in .gz,
+    .bz2 or .xz are decompressed or compressed on the fly.
+    """
+    if incremental and (output_file == STDIO_PATH or compression_for(output_file)):
+        raise ValueError("Incremental mode needs an uncompressed output file, not stdout")
+    sharding = {}
+    if shard_requests or shard_bytes:
+        if incremental or output_file == STDIO_PATH or compression_for(output_file):
+            raise ValueError("Sharded output can't be incremental, compressed or go to stdout")
+        sharding = {'requests_per_shard': shard_requests, 'max_shard_bytes': shard_bytes}
+
+    if stream:
+        convert_file_streaming(input_file, output_file, incremental, options, jobs, **sharding)
+        return
+
+    chat_data = cache.read_chat_file(input_file) if cache is not None else read_chat_file(input_file)
+
+    if incremental:
+        requests = chat_data.get('requests', [])
+        write_incremental(chat_data, [request_preview(request) for request in requests],
+                          [request_hash(request) for request in requests], requests, output_file, options, jobs)
+        return
+
+    # Keep only the compact request models while rendering; the collector
+    # would only walk the decoded export over and over while they are built
+    with _gc_paused():
+        session = ChatSession.from_dict(chat_data, consume=True)
+    del chat_data
+
+    if sharding:
+        write_sharded(session.header, session.previews(), session.requests, output_file,
+                      jobs=jobs, options=options, **sharding)
+        return
+
+    # Convert to markdown, writing each request as soon as it is rendered
+    with open_markdown_output(output_file) as out:
+        write_markdown(iter_markdown_chunks(session.header, session.previews(), session.requests, options, jobs), out)
+
+
+class ChatConversionError(Exception):
+    """Base class of the errors raised by Converter and convert."""
+
+
+class InvalidChatError(ChatConversionError, ValueError):
+    """The source is not a chat export: invalid JSON or an unexpected structure."""
+
+
+class ChatSourceError(ChatConversionError):
+    """The source could not be read, or is not of a supported type."""
+
+
+class ChatSinkError(ChatConversionError):
+    """The markdown could not be written to the sink, or it is not of a supported type."""
+
+
+# What rendering raises on an export of the wrong shape (a list where an
+# object was expected, a missing key); other exceptions are left alone
+MALFORMED_CHAT_ERRORS = (LookupError, TypeError, AttributeError, ValueError)
+
+
+class Converter:
+    """Convert chat exports to markdown from Python code.
+
+    A source can be a decoded dict, the export's bytes, a path (str or
+    os.PathLike) or a text or binary file object. A sink can be a path or a
+    text or binary file object; without one the markdown is returned as a
+    string. Unsupported sources and sinks, unreadable or malformed exports
+    and failed writes raise ChatConversionError subclasses.
+
+    A converter can be reused for any number of conversions, from several
+    threads at once. With `jobs` above 1 its worker pool is started on first
+    use and kept until close(), so repeated conversions don't pay for
+    starting processes; use it as a context manager to shut the pool down.
+    """
+
+    def __init__(self, options: RenderOptions = None, jobs: int = None):
+        if isinstance(options, dict):
+            options = RenderOptions(**options)
+        self.options = options or DEFAULT_RENDER_OPTIONS
+        self.jobs = jobs
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'Converter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the worker pool, if one was started."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def _pool(self) -> Optional[concurrent.futures.Executor]:
+        if not self.jobs or self.jobs == 1:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs)
+            return self._executor
+
+    def load(self, source: Any) -> Dict[str, Any]:
+        """Decode a chat export from any supported source."""
+        try:
+            if isinstance(source, dict):
+                chat_data = source
+            elif isinstance(source, (bytes, bytearray, memoryview)):
+                chat_data = decode_chat_json(decode_chat_bytes(source))
+            elif isinstance(source, (str, os.PathLike)):
+                chat_data = read_chat_file(os.fspath(source))
+            elif hasattr(source, 'read'):
+                data = source.read()
+                if isinstance(data, str):
+                    chat_data = decode_chat_json(sanitize_chat_text(data))
+                else:
+                    chat_data = decode_chat_json(decode_chat_bytes(data))
+            else:
+                raise ChatSourceError(f"Unsupported chat export source: {type(source).__name__}")
+        except (OSError, *CORRUPT_COMPRESSION_ERRORS) as e:
+            raise ChatSourceError(f"Could not read chat export: {e}") from e
+        except ValueError as e:
+            raise InvalidChatError(f"Invalid chat export: {e}") from e
+        requests = chat_data.get('requests', []) if isinstance(chat_data, dict) else None
+        if not (isinstance(requests, list) and all(isinstance(request, dict) for request in requests)):
+            raise InvalidChatError("Invalid chat export: expected an object with a 'requests' list of objects")
+        return chat_data
+
+    def iter_markdown(self, source: Any) -> Iterator[str]:
+        """Return the markdown of a chat export chunk by chunk (see iter_chat_markdown).
+
+        The source is decoded right away, so its errors are raised here.
+        """
+        chunks = iter_chat_markdown(self.load(source), self.options, self.jobs, self._pool())
+        if isinstance(source, dict):
+            # A decoded dict wasn't sanitized on input, so lone surrogates are replaced in the markdown
+            chunks = map(sanitize_surrogates, chunks)
+        return self._checked(chunks)
+
+    @staticmethod
+    def _checked(chunks: Iterator[str]) -> Iterator[str]:
+        """Pass chunks through, turning failures on a malformed export into InvalidChatError."""
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            except MALFORMED_CHAT_ERRORS as e:
+                raise InvalidChatError(f"Could not render chat export: {e}") from e
+            yield chunk
+
+    def convert(self, source: Any, sink: Any = None) -> Optional[str]:
+        """Convert a chat export, writing it to `sink` or returning the markdown if there is none."""
+        if not (sink is None or isinstance(sink, (str, os.PathLike)) or hasattr(sink, 'write')):
+            raise ChatSinkError(f"Unsupported markdown sink: {type(sink).__name__}")
+        chunks = self.iter_markdown(source)
+        if sink is None:
+            return ''.join(chunks)
+        try:
+            if isinstance(sink, (str, os.PathLike)):
+                with open_markdown_output(os.fspath(sink)) as out:
+                    write_markdown(chunks, out)
+            elif self._is_binary(sink):
+                for chunk in chunks:
+                    sink.write(chunk.encode('utf-8', errors='replace'))
+            else:
+                write_markdown(chunks, sink)
+        except (OSError, UnicodeEncodeError) as e:
+            # UnicodeEncodeError: a text sink whose encoding can't hold the markdown
+            raise ChatSinkError(f"Could not write markdown: {e}") from e
+        return None
+
+    @staticmethod
+    def _is_binary(sink: Any) -> bool:
+        """Whether a file-like sink takes bytes rather than str."""
+        if isinstance(sink, io.TextIOBase):
+            return False
+        if isinstance(sink, (io.RawIOBase, io.BufferedIOBase)):
+            return True
+        # Not an io class: ask the sink, since a mode (if any) needn't be a real one
+        try:
+            sink.write('')
+        except TypeError:
+            return True
+        return False
+
+
+def convert(source: Any, sink: Any = None, options: RenderOptions = None) -> Optional[str]:
+    """Convert one chat export with a throwaway Converter (see Converter.convert)."""
+    with Converter(options) as converter:
+        return converter.convert(source, sink)
+
+
+# Held by the active Profiler, which has the module's stage functions wrapped
+_PROFILER_LOCK = threading.Lock()
+
+
+class Profiler:
+    """Wall time and call counts per stage and part kind, plus peak memory.
+
+    While active, the profiler wraps the module's stage functions in place and
+    restores them on exit, so conversions cost nothing extra when no profiler
+    is running. Stage times are inclusive: a stage that calls another (for
+    example format_request calling format_message_text) includes its time.
+
+    Because the wrappers are module globals, only one profiler can be active
+    at a time, and conversions running in other threads meanwhile are counted
+    too (without locking, so their counts may be off). Worker processes
+    started for `jobs` are not wrapped: their rendering shows up only in the
+    total time.
+
+    Usage:
+        with Profiler() as profiler:
+            convert_file('chat.json', 'chat.md')
+        print(profiler.format_table())
+    """
+
+    # (stage, class name or None for a module function, attribute)
+    STAGES = [
+        ('read', None, '_read_chat_text'),
+        ('read', 'ChatExportStream', '_read_more'),
+        ('sanitize_surrogates', None, 'sanitize_surrogates'),
+        ('json_decode', None, 'decode_chat_json'),
+        ('json_decode', 'ChatExportStream', '_decode_value'),
+        ('format_request', None, 'format_request'),
+        ('tool_call_index', 'ToolCallIndex', '__init__'),
+        ('render_response_parts', None, 'render_response_texts'),
+        ('format_message_text', None, 'format_message_text'),
+        ('format_message_text', None, 'format_message_lines'),
+        ('write', None, '_write_chunk'),
+        ('write', None, '_encode_chunk'),
+    ]
+
+    # Rendering of each special response part kind
+    PART_KINDS = [
+        ('toolInvocationSerialized', 'ToolInvocationPart', 'render'),
+        ('textEditGroup', 'TextEditGroupPart', 'render'),
+        ('progressTaskSerialized', 'ProgressTaskPart', 'render'),
+    ]
+
+    # Number of slowest requests to report
+    SLOWEST_REQUESTS = 5
+
+    def __init__(self, track_memory: bool = True):
+        self.track_memory = track_memory
+        self.stages = {}
+        self.part_kinds = {}
+        self.request_seconds = []
+        self.total_seconds = 0.0
+        self.peak_memory = None
+        self._originals = []
+        self._started = None
+
+    def _wrap(self, func, totals: Dict[str, List], name: str, record_request: bool = False):
+        counter = totals.setdefault(name, [0, 0.0])
+        request_seconds = self.request_seconds
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                counter[0] += 1
+                counter[1] += elapsed
+                if record_request:
+                    # format_request(request, i, total)
+                    request_seconds.append((elapsed, args[1]))
+        return wrapper
+
+    def __enter__(self) -> 'Profiler':
+        if not _PROFILER_LOCK.acquire(blocking=False):
+            raise RuntimeError("Another Profiler is already active")
+        module = globals()
+        for totals, entries in ((self.stages, self.STAGES), (self.part_kinds, self.PART_KINDS)):
+            for name, owner_name, attribute in entries:
+                owner = module[owner_name] if owner_name else None
+                original = owner.__dict__[attribute] if owner else module[attribute]
+                wrapped = self._wrap(original, totals, name, record_request=(attribute == 'format_request'))
+                if owner:
+                    setattr(owner, attribute, wrapped)
                 else:
-                    model_display = model_id
-                model_info_parts.append(model_display)
-            
-            if details and details != model_display:
-                model_info_parts.append(details)
-            
-            if model_info_parts:
-                model_info = ' • '.join(model_info_parts)
-                metadata_lines.append(f"> <br>*Model: {model_info}*")
-        
-        # Add all metadata lines
-        if metadata_lines:
-            for line in metadata_lines:
-                md_lines.append(line)
-            md_lines.append("")
-        
-        # Add separator between requests
-        if i < len(requests):
-            md_lines.append("---")
-            md_lines.append("")
-    
-    return '\n'.join(md_lines)
+                    module[attribute] = wrapped
+                self._originals.append((owner, attribute, original))
 
+        if self.track_memory:
+            tracemalloc.start()
+        self._started = time.perf_counter()
+        return self
 
-def sanitize_surrogates(text: str) -> str:
-    """Replace lone Unicode surrogates (U+D800-U+DFFF) that can't be encoded in UTF-8.
+    def __exit__(self, *exc_info) -> None:
+        self.total_seconds = time.perf_counter() - self._started
+        if self.track_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
 
-    These can appear when VS Code exports chat containing certain emoji/braille art
-    characters that get serialized as unpaired surrogates in the JSON.
+        module = globals()
+        for owner, attribute, original in reversed(self._originals):
+            if owner:
+                setattr(owner, attribute, original)
+            else:
+                module[attribute] = original
+        self._originals = []
+        _PROFILER_LOCK.release()
+
+    def report(self) -> Dict[str, Any]:
+        """Return the collected measurements as a JSON-serializable dict."""
+        def rows(totals, key):
+            return [{key: name, 'calls': calls, 'seconds': round(seconds, 6)}
+                    for name, (calls, seconds) in sorted(totals.items(), key=lambda item: -item[1][1]) if calls]
+
+        slowest = sorted(self.request_seconds, reverse=True)[:self.SLOWEST_REQUESTS]
+        return {
+            'total_seconds': round(self.total_seconds, 6),
+            'peak_memory_bytes': self.peak_memory,
+            'stages': rows(self.stages, 'stage'),
+            'part_kinds': rows(self.part_kinds, 'kind'),
+            'slowest_requests': [{'request': i, 'seconds': round(seconds, 6)} for seconds, i in slowest],
+        }
+
+    def format_table(self) -> str:
+        """Format the collected measurements as a plain-text table."""
+        report = self.report()
+        lines = [f"Total: {report['total_seconds']:.3f} s"]
+        if report['peak_memory_bytes'] is not None:
+            lines.append(f"Peak memory (tracemalloc): {report['peak_memory_bytes'] / (1024 * 1024):.1f} MB")
+        for title, key, entries in (('Stage', 'stage', report['stages']), ('Part kind', 'kind', report['part_kinds'])):
+            if not entries:
+                continue
+            lines.append("")
+            lines.append(f"{title:<28} {'calls':>9} {'seconds':>10}")
+            for entry in entries:
+                lines.append(f"{entry[key]:<28} {entry['calls']:>9} {entry['seconds']:>10.3f}")
+        if report['slowest_requests']:
+            lines.append("")
+            lines.append("Slowest requests: " + ', '.join(
+                f"#{entry['request']} ({entry['seconds']:.3f} s)" for entry in report['slowest_requests']))
+        return '\n'.join(lines)
+
+
+def describe_error(input_file: str, error: Exception) -> str:
+    """Describe a conversion error the way the CLI reports it."""
+    if isinstance(error, FileNotFoundError):
+        return f"Could not find input file '{input_file}'"
+    if isinstance(error, json.JSONDecodeError):
+        return f"Invalid JSON in '{input_file}': {error}"
+    if isinstance(error, CORRUPT_COMPRESSION_ERRORS):
+        return f"Corrupt compressed file '{input_file}': {error}"
+    return str(error)
+
+
+_GLOB_MAGIC = re.compile('[*?[]')
+
+
+def collect_input_files(sources: List[str], manifest: str = None) -> List[Tuple[str, str]]:
+    """Expand directories, glob patterns and manifest entries into input files.
+
+    Returns (input_file, base_dir) pairs; base_dir is the directory the file's
+    output path is made relative to.
+    """
+    entries = list(sources)
+    if manifest:
+        manifest_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                # Skip blank lines and comments
+                if not line or line.startswith('#'):
+                    continue
+                entries.append(os.path.join(manifest_dir, line))
+
+    found = []
+    seen = set()
+
+    def add(path, base_dir):
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            found.append((path, base_dir))
+
+    for entry in entries:
+        if os.path.isdir(entry):
+            for root, dirs, files in os.walk(entry):
+                dirs.sort()
+                for name in sorted(files):
+                    if strip_compression_suffix(name).lower().endswith('.json'):
+                        add(os.path.join(root, name), entry)
+        elif glob.has_magic(entry):
+            # Output paths mirror the tree below the pattern's fixed leading directories
+            base_dir = os.path.dirname(entry[:_GLOB_MAGIC.search(entry).start()])
+            for path in sorted(glob.glob(entry, recursive=True)):
+                if os.path.isfile(path):
+                    add(path, base_dir)
+        else:
+            # Missing files are kept so they get reported as failures
+            add(entry, os.path.dirname(entry))
+
+    return found
+
+
+def add_render_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the size limit options shared by every converting command."""
+    parser.add_argument('--max-tool-output-bytes', type=int, metavar='N', help='Truncate the content shown for each tool result to N bytes')
+    parser.add_argument('--max-edit-bytes', type=int, metavar='N', help='Truncate the combined text of each file edit group (one batch of edits to a file) to N bytes')
+    parser.add_argument('--max-lines', type=int, metavar='N', help='Truncate each tool result and file edit to N lines')
+    parser.add_argument('--dedupe', action='store_true', help='Show repeated tool results and file edits as a reference to the first one')
+
+
+def render_options_from_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> RenderOptions:
+    """Build RenderOptions from the arguments added by add_render_arguments."""
+    options = RenderOptions(args.max_tool_output_bytes, args.max_edit_bytes, args.max_lines, args.dedupe)
+    for name, value in options.to_dict().items():
+        if value is not None and value < 0:
+            parser.error(f"--{name.replace('_', '-')} must not be negative")
+    return options
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the parse cache options shared by the converting commands."""
+    parser.add_argument('--cache-dir', metavar='DIR', help='Keep decoded exports in DIR to skip JSON decoding when the same content is converted again')
+    parser.add_argument('--cache-size', type=int, metavar='MB', default=DEFAULT_PARSE_CACHE_BYTES >> 20,
+                        help=f'Size budget of --cache-dir; least recently used entries are removed (default: {DEFAULT_PARSE_CACHE_BYTES >> 20})')
+
+
+def cache_from_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> Optional[ParseCache]:
+    """Build the ParseCache selected by the arguments added by add_cache_arguments."""
+    if args.cache_size < 0:
+        parser.error('--cache-size must not be negative')
+    if not args.cache_dir:
+        return None
+    if args.stream:
+        parser.error('--cache-dir can\'t be combined with --stream')
+    return ParseCache(args.cache_dir, args.cache_size << 20)
+
+
+def batch_output_path(input_file: str, base_dir: str, output_dir: str = None) -> str:
+    """Work out where the markdown for a batch input file is written."""
+    stem = os.path.splitext(strip_compression_suffix(input_file))[0] + '.md'
+    if not output_dir:
+        return stem
+    # Mirror the layout below the source directory to avoid name clashes
+    relative = os.path.relpath(stem, base_dir or '.')
+    return os.path.join(output_dir, relative)
+
+
+def find_output_clashes(items: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+    """Map each output path written by more than one input to those inputs."""
+    inputs_by_output = {}
+    for input_file, output_file in items:
+        key = os.path.normcase(os.path.abspath(output_file))
+        inputs_by_output.setdefault(key, []).append(input_file)
+    return {output_file: inputs for output_file, inputs in inputs_by_output.items() if len(inputs) > 1}
+
+
+def _convert_batch_item(item: Tuple[str, str, Dict[str, Any]]) -> Tuple[str, str, str]:
+    """Convert one batch entry, returning an error description instead of raising."""
+    input_file, output_file, options = item
+    try:
+        output_parent = os.path.dirname(output_file)
+        if output_parent:
+            os.makedirs(output_parent, exist_ok=True)
+        convert_file(input_file, output_file, **options)
+        return input_file, output_file, None
+    except Exception as e:
+        return input_file, output_file, describe_error(input_file, e)
+
+
+def run_batch(items: List[Tuple[str, str]], jobs: int = None, **options) -> List[Tuple[str, str, str]]:
+    """Convert many (input_file, output_file) pairs, spread over a process pool.
+
+    Keyword options are passed on to convert_file. Failures are collected per
+    file; the run never stops early.
+    """
+    items = [(input_file, output_file, options) for input_file, output_file in items]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(items) <= 1:
+        return [_convert_batch_item(item) for item in items]
+
+    # Hand out several files per task so small exports don't drown in IPC
+    chunksize = max(1, min(32, len(items) // (jobs * 4)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_convert_batch_item, items, chunksize=chunksize))
+
+
+def batch_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog='chat_to_markdown.py batch',
+        description="Convert many Copilot chat log JSON files in parallel",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python chat_to_markdown.py batch exports/ --output-dir markdown/ --jobs 16
+  python chat_to_markdown.py batch 'exports/**/*.json' --manifest extra.txt
+        """
+    )
+    parser.add_argument('sources', nargs='*', help='Input JSON files, directories or glob patterns')
+    parser.add_argument('--manifest', help='File listing one input path per line (relative to the manifest)')
+    parser.add_argument('-o', '--output-dir', help='Directory for markdown files (default: next to each input)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--stream', action='store_true', help='Decode one request at a time to bound memory use')
+    parser.add_argument('--incremental', action='store_true', help='Only render requests that are new or changed since the last --incremental run')
+    add_render_arguments(parser)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+    options = render_options_from_args(parser, args)
+    cache = cache_from_args(parser, args)
+    if not args.sources and not args.manifest:
+        parser.error('no input files given')
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    try:
+        inputs = collect_input_files(args.sources, args.manifest)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    items = [(path, batch_output_path(path, base_dir, args.output_dir)) for path, base_dir in inputs]
+    clashes = find_output_clashes(items)
+    if clashes:
+        # Converting would silently overwrite one input's markdown with another's
+        for output_file, input_files in clashes.items():
+            print(f"Error: {', '.join(input_files)} would all be written to {output_file}", file=sys.stderr)
+        sys.exit(1)
+    results = run_batch(items, args.jobs, stream=args.stream, incremental=args.incremental, options=options,
+                        cache=cache)
+
+    failures = [(input_file, error) for input_file, _, error in results if error]
+    for input_file, error in failures:
+        print(f"Error: {input_file}: {error}", file=sys.stderr)
+    print(f"Converted {len(results) - len(failures)} of {len(results)} files ({len(failures)} failed)")
+
+    if failures:
+        sys.exit(1)
+
+
+def file_content_hash(path: str) -> str:
+    """SHA-1 of a file's bytes, read in chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExportWatcher:
+    """Poll chat exports and report the ones that need converting again.
+
+    A file is picked up once its size or mtime changes and then stays unchanged
+    for `debounce` seconds, so bursts of writes cause a single conversion. A
+    file whose content hash matches the last conversion is skipped.
     """
-    import re
-    return re.sub(r'[\ud800-\udfff]', '\ufffd', text)
+
+    def __init__(self, sources: List[str], output_dir: str = None, debounce: float = 2.0):
+        self.sources = sources
+        self.output_dir = output_dir
+        self.debounce = debounce
+        self._signatures = {}
+        self._changed_at = {}
+        self._converted_hashes = {}
+
+    def poll(self, now: float) -> List[Tuple[str, str]]:
+        """Return (input_file, output_file) pairs that are due for conversion."""
+        candidates = [(input_file, batch_output_path(input_file, base_dir, self.output_dir))
+                      for input_file, base_dir in collect_input_files(self.sources)]
+        # The markdown and state files written for the watched exports may sit
+        # in a watched directory too; they are never exports themselves
+        produced = set()
+        for _, output_file in candidates:
+            for path in (output_file, incremental_state_path(output_file), _legacy_incremental_state_path(output_file)):
+                produced.add(os.path.abspath(path))
+
+        due = []
+        for input_file, output_file in candidates:
+            if os.path.abspath(input_file) in produced:
+                continue
+            try:
+                st = os.stat(input_file)
+            except OSError:
+                # Deleted or not created yet
+                self._signatures.pop(input_file, None)
+                self._changed_at.pop(input_file, None)
+                continue
+
+            signature = (st.st_size, st.st_mtime_ns)
+            if self._signatures.get(input_file) != signature:
+                self._signatures[input_file] = signature
+                self._changed_at[input_file] = now
+                continue
+
+            changed_at = self._changed_at.get(input_file)
+            if changed_at is None or now - changed_at < self.debounce:
+                continue
+            del self._changed_at[input_file]
+
+            try:
+                content_hash = file_content_hash(input_file)
+            except OSError:
+                continue
+            if self._converted_hashes.get(input_file) == content_hash:
+                continue
+            self._converted_hashes[input_file] = content_hash
+            due.append((input_file, output_file))
+        return due
 
 
-def main():
+def watch_main(argv: List[str]) -> None:
     parser = argparse.ArgumentParser(
-        description="Convert a Copilot chat log JSON file to markdown format",
+        prog='chat_to_markdown.py watch',
+        description="Keep markdown copies of chat exports up to date as the exports change",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
-  python chat_to_markdown.py input.json output.md
+  python chat_to_markdown.py watch exports/ --output-dir markdown/
+  python chat_to_markdown.py watch session.json --interval 0.5 --debounce 5
         """
     )
-    parser.add_argument('input_file', help='Input JSON file (chat log)')
-    parser.add_argument('output_file', help='Output markdown file')
-    
-    args = parser.parse_args()
-    
+    parser.add_argument('sources', nargs='+', help='Input JSON files, directories or glob patterns to watch')
+    parser.add_argument('-o', '--output-dir', help='Directory for markdown files (default: next to each input)')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls (default: 1)')
+    parser.add_argument('--debounce', type=float, default=2.0, help='Seconds a file must stay unchanged before converting (default: 2)')
+    parser.add_argument('--stream', action='store_true', help='Decode one request at a time to bound memory use')
+    parser.add_argument('--full', action='store_true', help='Re-render whole files instead of updating them incrementally')
+    add_render_arguments(parser)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+    render_options = render_options_from_args(parser, args)
+    cache = cache_from_args(parser, args)
+    if args.interval <= 0:
+        parser.error('--interval must be positive')
+
+    watcher = ExportWatcher(args.sources, args.output_dir, args.debounce)
+    options = {'stream': args.stream, 'incremental': not args.full, 'options': render_options, 'cache': cache}
+    print(f"Watching {', '.join(args.sources)} (Ctrl+C to stop)", file=sys.stderr)
     try:
-        # Read the JSON file, allowing surrogates during decode
-        with open(args.input_file, 'r', encoding='utf-8', errors='surrogatepass') as f:
-            raw_text = f.read()
+        while True:
+            for input_file, output_file in watcher.poll(time.monotonic()):
+                _, _, error = _convert_batch_item((input_file, output_file, options))
+                if error:
+                    print(f"Error: {input_file}: {error}", file=sys.stderr)
+                else:
+                    print(f"Converted {input_file} to {output_file}", flush=True)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
 
-        # Sanitize any lone surrogates before JSON parsing
-        raw_text = sanitize_surrogates(raw_text)
-        chat_data = json.loads(raw_text)
-        
-        # Convert to markdown and sanitize any surrogates that survived
-        markdown_content = sanitize_surrogates(parse_chat_log(chat_data))
-        
-        # Write the markdown file with replace fallback for safety
-        with open(args.output_file, 'w', encoding='utf-8', errors='replace') as f:
-            f.write(markdown_content)
-        
-        print(f"Successfully converted {args.input_file} to {args.output_file}")
-        
-    except FileNotFoundError:
-        print(f"Error: Could not find input file '{args.input_file}'", file=sys.stderr)
+
+# VS Code keeps each chat session of a workspace in
+# workspaceStorage/<workspace id>/chatSessions/<session id>.json
+CHAT_SESSIONS_DIR = 'chatSessions'
+
+CATALOG_VERSION = 1
+
+
+def find_chat_sessions(roots: List[str]) -> List[Tuple[str, str]]:
+    """Find chat session files below the given directories.
+
+    Returns (session_file, root) pairs for every JSON file in a chatSessions
+    directory, so a copied workspaceStorage tree can be scanned as a whole.
+    """
+    found = []
+    for root in roots:
+        for directory, dirs, files in os.walk(root):
+            dirs.sort()
+            if os.path.basename(directory) != CHAT_SESSIONS_DIR:
+                continue
+            for name in sorted(files):
+                if name.lower().endswith('.json'):
+                    found.append((os.path.join(directory, name), root))
+    return found
+
+
+class SessionCatalog:
+    """On-disk record of the chat sessions converted by `scan`.
+
+    Each session is stored with its size, mtime, content hash and output file.
+    A session whose size and mtime are unchanged is skipped without reading it;
+    otherwise it is hashed and only converted if its content changed. The
+    catalog is discarded when the render options differ from the last run.
+    """
+
+    def __init__(self, path: str, options: RenderOptions):
+        self.path = path
+        self.options = options.to_dict()
+        self.sessions = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (isinstance(catalog, dict) and catalog.get('version') == CATALOG_VERSION
+                and catalog.get('options') == self.options):
+            self.sessions = catalog.get('sessions', {})
+
+    def check(self, session_file: str, output_file: str) -> Tuple[bool, Dict[str, Any]]:
+        """Return (changed, entry): whether the session needs converting, and its new catalog entry."""
+        st = os.stat(session_file)
+        output_file = os.path.abspath(output_file)
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'output': output_file}
+        old = self.sessions.get(os.path.abspath(session_file))
+        if old is None or old.get('output') != output_file or not os.path.exists(output_file):
+            entry['hash'] = file_content_hash(session_file)
+            return True, entry
+        if old.get('size') == entry['size'] and old.get('mtime_ns') == entry['mtime_ns']:
+            return False, old
+        # Touched but possibly not modified (e.g. copied again)
+        entry['hash'] = file_content_hash(session_file)
+        return entry['hash'] != old.get('hash'), entry
+
+    def record(self, session_file: str, entry: Dict[str, Any]) -> None:
+        self.sessions[os.path.abspath(session_file)] = entry
+
+    def prune(self, session_files: Iterable[str]) -> int:
+        """Forget sessions that are no longer on disk; return how many were dropped."""
+        keep = {os.path.abspath(path) for path in session_files}
+        gone = [path for path in self.sessions if path not in keep]
+        for path in gone:
+            del self.sessions[path]
+        return len(gone)
+
+    def save(self) -> None:
+        """Write the catalog, replacing the old one only once it is complete."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        catalog = {'version': CATALOG_VERSION, 'options': self.options, 'sessions': self.sessions}
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False,
+                                         prefix='.catalog-', suffix='.tmp') as f:
+            json.dump(catalog, f, indent=1, sort_keys=True)
+        os.replace(f.name, self.path)
+
+
+def scan_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog='chat_to_markdown.py scan',
+        description="Convert new or changed chat sessions found in copies of VS Code's workspaceStorage",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python chat_to_markdown.py scan ~/.config/Code/User/workspaceStorage --output-dir markdown/
+  python chat_to_markdown.py scan archive/ --output-dir markdown/ --catalog archive.catalog.json --jobs 16
+        """
+    )
+    parser.add_argument('roots', nargs='+', help='Directories searched for chatSessions/*.json files')
+    parser.add_argument('-o', '--output-dir', required=True, help='Directory for markdown files')
+    parser.add_argument('--catalog', help='Catalog of converted sessions (default: catalog.json in the output directory)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--stream', action='store_true', help='Decode one request at a time to bound memory use')
+    add_render_arguments(parser)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+    options = render_options_from_args(parser, args)
+    cache = cache_from_args(parser, args)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    for root in args.roots:
+        if not os.path.isdir(root):
+            parser.error(f"not a directory: {root}")
+
+    catalog = SessionCatalog(args.catalog or os.path.join(args.output_dir, 'catalog.json'), options)
+    sessions = find_chat_sessions(args.roots)
+    due = []
+    failures = []
+    unchanged = 0
+    for session_file, root in sessions:
+        output_file = batch_output_path(session_file, root, args.output_dir)
+        try:
+            changed, entry = catalog.check(session_file, output_file)
+        except OSError as e:
+            failures.append((session_file, describe_error(session_file, e)))
+            continue
+        if changed:
+            due.append((session_file, output_file, entry))
+        else:
+            catalog.record(session_file, entry)
+            unchanged += 1
+
+    entries = {session_file: entry for session_file, _, entry in due}
+    results = run_batch([(session_file, output_file) for session_file, output_file, _ in due], args.jobs,
+                        stream=args.stream, options=options, cache=cache)
+    converted = 0
+    for session_file, _, error in results:
+        if error:
+            failures.append((session_file, error))
+        else:
+            catalog.record(session_file, entries[session_file])
+            converted += 1
+    catalog.prune(session_file for session_file, _ in sessions)
+    catalog.save()
+
+    for session_file, error in failures:
+        print(f"Error: {session_file}: {error}", file=sys.stderr)
+    print(f"Scanned {len(sessions)} sessions: {converted} converted, {unchanged} unchanged, {len(failures)} failed")
+
+    if failures:
+        sys.exit(1)
+
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    requester TEXT,
+    responder TEXT,
+    request_count INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    number INTEGER NOT NULL,
+    request_id TEXT,
+    timestamp INTEGER,
+    model TEXT,
+    details TEXT,
+    first_progress_ms INTEGER,
+    elapsed_ms INTEGER,
+    error TEXT,
+    UNIQUE (session_id, number)
+);
+CREATE TABLE IF NOT EXISTS tool_calls (
+    request_id INTEGER NOT NULL REFERENCES requests(id),
+    call_id TEXT,
+    tool TEXT,
+    message TEXT,
+    arguments TEXT
+);
+CREATE TABLE IF NOT EXISTS file_edits (
+    request_id INTEGER NOT NULL REFERENCES requests(id),
+    path TEXT NOT NULL,
+    edits INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_model ON requests(model);
+CREATE INDEX IF NOT EXISTS tool_calls_request ON tool_calls(request_id);
+CREATE INDEX IF NOT EXISTS tool_calls_tool ON tool_calls(tool);
+CREATE INDEX IF NOT EXISTS file_edits_request ON file_edits(request_id);
+CREATE INDEX IF NOT EXISTS file_edits_path ON file_edits(path);
+-- Full-text index of each request; rowid is requests.id
+CREATE VIRTUAL TABLE IF NOT EXISTS request_text USING fts5(message, response, tools, files);
+"""
+
+
+def open_chat_index(path: str) -> sqlite3.Connection:
+    """Open (creating if needed) a SQLite index of converted chat sessions."""
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(INDEX_SCHEMA)
+    return connection
+
+
+def _delete_indexed_session(connection: sqlite3.Connection, session_id: int) -> None:
+    requests = '(SELECT id FROM requests WHERE session_id = ?)'
+    connection.execute(f'DELETE FROM request_text WHERE rowid IN {requests}', (session_id,))
+    connection.execute(f'DELETE FROM tool_calls WHERE request_id IN {requests}', (session_id,))
+    connection.execute(f'DELETE FROM file_edits WHERE request_id IN {requests}', (session_id,))
+    connection.execute('DELETE FROM requests WHERE session_id = ?', (session_id,))
+    connection.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+
+def index_session(connection: sqlite3.Connection, input_file: str) -> bool:
+    """Add or replace one chat export in the index; return False if it was unchanged.
+
+    A session whose size and mtime match the index is skipped without reading
+    it, and one whose content hash matches is only re-stamped. Otherwise the
+    export is streamed once and all its rows are replaced in one transaction.
+    """
+    path = os.path.abspath(input_file)
+    st = os.stat(input_file)
+    row = connection.execute('SELECT id, size, mtime_ns, hash FROM sessions WHERE path = ?', (path,)).fetchone()
+    if row is not None and row[1:3] == (st.st_size, st.st_mtime_ns):
+        return False
+    content_hash = file_content_hash(input_file)
+    if row is not None and row[3] == content_hash:
+        with connection:
+            connection.execute('UPDATE sessions SET size = ?, mtime_ns = ? WHERE id = ?',
+                               (st.st_size, st.st_mtime_ns, row[0]))
+        return False
+
+    with connection, open_chat_stream(input_file) as reader:
+        if row is not None:
+            _delete_indexed_session(connection, row[0])
+        session_id = connection.execute(
+            'INSERT INTO sessions (path, size, mtime_ns, hash, request_count, indexed_at) VALUES (?, ?, ?, ?, 0, ?)',
+            (path, st.st_size, st.st_mtime_ns, content_hash, time.time())).lastrowid
+        number = 0
+        for number, request in enumerate(reader.iter_requests(), 1):
+            summary = summarize_request(request)
+            request_id = connection.execute(
+                'INSERT INTO requests (session_id, number, request_id, timestamp, model, details, '
+                'first_progress_ms, elapsed_ms, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (session_id, number, summary['request_id'], summary['timestamp'], summary['model'],
+                 summary['details'], summary['first_progress_ms'], summary['elapsed_ms'],
+                 summary['error'])).lastrowid
+            calls = summary['tool_calls']
+            edits = summary['file_edits']
+            connection.executemany(
+                'INSERT INTO tool_calls (request_id, call_id, tool, message, arguments) VALUES (?, ?, ?, ?, ?)',
+                [(request_id, call['id'], call['tool'], call['message'], call['arguments']) for call in calls])
+            connection.executemany(
+                'INSERT INTO file_edits (request_id, path, edits) VALUES (?, ?, ?)',
+                [(request_id, edit['path'], edit['edits']) for edit in edits])
+            # File paths are searchable both from edits and from tool messages like "Read [](file://...)"
+            tool_text = '\n'.join(f"{call['tool'] or ''} {call['message']}" for call in calls)
+            files = [edit['path'] for edit in edits] + _FILE_URI_PATH.findall(tool_text)
+            connection.execute(
+                'INSERT INTO request_text (rowid, message, response, tools, files) VALUES (?, ?, ?, ?, ?)',
+                (request_id, summary['message'], summary['response'], tool_text, '\n'.join(dict.fromkeys(files))))
+        connection.execute('UPDATE sessions SET requester = ?, responder = ?, request_count = ? WHERE id = ?',
+                           (reader.header.get('requesterUsername'), reader.header.get('responderUsername'),
+                            number, session_id))
+    return True
+
+
+def fts_query(text: str) -> str:
+    """Turn plain search words into an FTS5 query matching all of them.
+
+    Each word is quoted, so names like deploy.yaml or foo-bar are matched as
+    phrases instead of being parsed as query syntax.
+    """
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def search_index(connection: sqlite3.Connection, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Return the requests best matching an FTS5 query, most relevant first."""
+    rows = connection.execute(
+        "SELECT sessions.path, requests.number, requests.timestamp, requests.model, "
+        "snippet(request_text, -1, '[', ']', '...', 12) "
+        "FROM request_text JOIN requests ON requests.id = request_text.rowid "
+        "JOIN sessions ON sessions.id = requests.session_id "
+        "WHERE request_text MATCH ? ORDER BY rank LIMIT ?", (query, limit))
+    return [{'path': path, 'request': number, 'timestamp': timestamp, 'model': model, 'snippet': snippet}
+            for path, number, timestamp, model, snippet in rows]
+
+
+def index_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog='chat_to_markdown.py index',
+        description="Add chat exports to a SQLite database for full-text search",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python chat_to_markdown.py index chats.db exports/ 'archive/**/*.json'
+  python chat_to_markdown.py search chats.db deploy.yaml
+        """
+    )
+    parser.add_argument('database', help='SQLite database file (created if missing)')
+    parser.add_argument('sources', nargs='*', help='Input JSON files, directories or glob patterns')
+    parser.add_argument('--manifest', help='File listing one input path per line (relative to the manifest)')
+
+    args = parser.parse_args(argv)
+    if not args.sources and not args.manifest:
+        parser.error('no input files given')
+
+    try:
+        inputs = collect_input_files(args.sources, args.manifest)
+        connection = open_chat_index(args.database)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    indexed = 0
+    failures = []
+    with contextlib.closing(connection):
+        for input_file, _ in inputs:
+            try:
+                indexed += index_session(connection, input_file)
+            except Exception as e:
+                failures.append((input_file, describe_error(input_file, e)))
+
+    for input_file, error in failures:
+        print(f"Error: {input_file}: {error}", file=sys.stderr)
+    print(f"Indexed {indexed} of {len(inputs)} sessions ({len(inputs) - indexed - len(failures)} unchanged, "
+          f"{len(failures)} failed)")
+
+    if failures:
         sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON in '{args.input_file}': {e}", file=sys.stderr)
+
+
+def search_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog='chat_to_markdown.py search',
+        description="Search chat sessions added with the index subcommand",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python chat_to_markdown.py search chats.db deploy.yaml
+  python chat_to_markdown.py search chats.db --fts 'files:"deploy.yaml" AND response:rollback'
+        """
+    )
+    parser.add_argument('database', help='SQLite database written by the index subcommand')
+    parser.add_argument('query', nargs='+', help='Words that must all appear in a request')
+    parser.add_argument('--fts', action='store_true', help='Pass the query to SQLite as FTS5 syntax '
+                        '(columns: message, response, tools, files)')
+    parser.add_argument('-n', '--limit', type=int, default=20, help='Maximum number of results (default: 20)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    args = parser.parse_args(argv)
+    if args.limit < 1:
+        parser.error('--limit must be at least 1')
+    if not os.path.exists(args.database):
+        parser.error(f"no index at {args.database}")
+    query = ' '.join(args.query)
+
+    try:
+        with contextlib.closing(open_chat_index(args.database)) as connection:
+            results = search_index(connection, query if args.fts else fts_query(query), args.limit)
+    except sqlite3.Error as e:
+        print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        when = format_timestamp(result['timestamp']) if result['timestamp'] else ''
+        print(f"{result['path']} #{result['request']}  {when}  {result['model'] or ''}".rstrip())
+        print(f"    {' '.join(result['snippet'].split())}")
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Linearly interpolated percentile of sorted values, for a fraction between 0 and 1."""
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+# Latency percentiles reported per model
+STATS_PERCENTILES = (50, 90, 95, 99)
+
+
+class ChatStats:
+    """Aggregates of request metadata over any number of chat exports.
+
+    Requests are summarized with summarize_request, so no markdown is
+    rendered. Stats of separate files can be combined with merge.
+    """
+
+    def __init__(self):
+        self.sessions = 0
+        self.requests = 0
+        self.errors = 0
+        # model -> response times in ms
+        self.latencies = {}
+        self.model_requests = collections.Counter()
+        self.model_errors = collections.Counter()
+        self.tool_calls = collections.Counter()
+        self.file_edits = collections.Counter()
+        self.requests_per_day = collections.Counter()
+
+    def add_request(self, summary: Dict[str, Any]) -> None:
+        model = summary['model'] or 'unknown'
+        self.requests += 1
+        self.model_requests[model] += 1
+        if summary['error']:
+            self.errors += 1
+            self.model_errors[model] += 1
+        elapsed = summary['elapsed_ms']
+        if isinstance(elapsed, (int, float)):
+            self.latencies.setdefault(model, []).append(elapsed)
+        for call in summary['tool_calls']:
+            self.tool_calls[call['tool'] or 'unknown'] += 1
+        for edit in summary['file_edits']:
+            self.file_edits[edit['path']] += edit['edits']
+        timestamp = summary['timestamp']
+        if isinstance(timestamp, (int, float)):
+            try:
+                self.requests_per_day[datetime.fromtimestamp(timestamp / 1000).strftime('%Y-%m-%d')] += 1
+            except (ValueError, OverflowError, OSError):
+                pass
+
+    def add_file(self, input_file: str) -> None:
+        """Stream the requests of one chat export into the aggregates."""
+        with open_chat_stream(input_file) as reader:
+            for request in reader.iter_requests():
+                self.add_request(summarize_request(request))
+        self.sessions += 1
+
+    def merge(self, other: 'ChatStats') -> None:
+        self.sessions += other.sessions
+        self.requests += other.requests
+        self.errors += other.errors
+        for model, latencies in other.latencies.items():
+            self.latencies.setdefault(model, []).extend(latencies)
+        for name in ('model_requests', 'model_errors', 'tool_calls', 'file_edits', 'requests_per_day'):
+            getattr(self, name).update(getattr(other, name))
+
+    def report(self) -> Dict[str, Any]:
+        """Return the aggregates as a JSON-serializable dict."""
+        models = {}
+        for model, count in self.model_requests.most_common():
+            latencies = sorted(self.latencies.get(model, []))
+            entry = {'requests': count, 'errors': self.model_errors[model],
+                     'error_rate': self.model_errors[model] / count}
+            if latencies:
+                entry['latency_ms'] = dict(
+                    {f'p{p}': round(percentile(latencies, p / 100), 1) for p in STATS_PERCENTILES},
+                    min=latencies[0], max=latencies[-1], mean=round(sum(latencies) / len(latencies), 1))
+            models[model] = entry
+        return {
+            'sessions': self.sessions,
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': self.errors / self.requests if self.requests else 0.0,
+            'models': models,
+            'tool_calls': dict(self.tool_calls.most_common()),
+            'file_edits': dict(self.file_edits.most_common()),
+            'requests_per_day': dict(sorted(self.requests_per_day.items())),
+        }
+
+    def rows(self) -> Iterator[Tuple[str, str, str, Any]]:
+        """Yield (section, key, metric, value) rows of the report, for CSV output."""
+        report = self.report()
+        for metric in ('sessions', 'requests', 'errors', 'error_rate'):
+            yield 'total', '', metric, report[metric]
+        for model, entry in report['models'].items():
+            for metric in ('requests', 'errors', 'error_rate'):
+                yield 'model', model, metric, entry[metric]
+            for metric, value in entry.get('latency_ms', {}).items():
+                yield 'model', model, f'latency_ms_{metric}', value
+        for section, metric in (('tool_calls', 'calls'), ('file_edits', 'edits'), ('requests_per_day', 'requests')):
+            for key, value in report[section].items():
+                yield section, key, metric, value
+
+
+def _collect_file_stats(input_file: str) -> Tuple[str, Optional[ChatStats], Optional[str]]:
+    """Aggregate one export, returning an error description instead of raising."""
+    stats = ChatStats()
+    try:
+        stats.add_file(input_file)
+        return input_file, stats, None
     except Exception as e:
+        return input_file, None, describe_error(input_file, e)
+
+
+def collect_stats(input_files: List[str], jobs: int = None) -> Tuple[ChatStats, List[Tuple[str, str]]]:
+    """Aggregate many exports, spread over a process pool; return the stats and (file, error) failures."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(input_files) <= 1:
+        results = map(_collect_file_stats, input_files)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(_collect_file_stats, input_files)
+
+    total = ChatStats()
+    failures = []
+    try:
+        for input_file, stats, error in results:
+            if error:
+                failures.append((input_file, error))
+            else:
+                total.merge(stats)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return total, failures
+
+
+def stats_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog='chat_to_markdown.py stats',
+        description="Aggregate request metadata of chat exports without converting them",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python chat_to_markdown.py stats exports/ > stats.json
+  python chat_to_markdown.py stats 'archive/**/*.json' --format csv --jobs 16 > stats.csv
+        """
+    )
+    parser.add_argument('sources', nargs='*', help="Input JSON files, directories or glob patterns ('-' for stdin)")
+    parser.add_argument('--manifest', help='File listing one input path per line (relative to the manifest)')
+    parser.add_argument('--format', choices=['json', 'csv'], default='json', help='Output format (default: json)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes (default: CPU count)')
+
+    args = parser.parse_args(argv)
+    if not args.sources and not args.manifest:
+        parser.error('no input files given')
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    try:
+        inputs = [path for path, _ in collect_input_files(args.sources, args.manifest)]
+    except OSError as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
+    stats, failures = collect_stats(inputs, args.jobs)
+    for input_file, error in failures:
+        print(f"Error: {input_file}: {error}", file=sys.stderr)
+
+    if args.format == 'csv':
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(['section', 'key', 'metric', 'value'])
+        writer.writerows(stats.rows())
+    else:
+        print(json.dumps(stats.report(), indent=2))
+
+    if failures:
+        sys.exit(1)
+
+
+# Subcommands selected by the first command-line argument
+SUBCOMMANDS = {
+    'batch': batch_main,
+    'watch': watch_main,
+    'scan': scan_main,
+    'index': index_main,
+    'search': search_main,
+    'stats': stats_main,
+}
+
+
+def main(argv: List[str] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in SUBCOMMANDS:
+        SUBCOMMANDS[argv[0]](argv[1:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description="Convert a Copilot chat log JSON file to markdown format",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python chat_to_markdown.py input.json output.md
+  python chat_to_markdown.py --stream - - < input.json | gzip > output.md.gz
+  python chat_to_markdown.py --stream archive/input.json.xz output.md.gz
+  python chat_to_markdown.py --max-tool-output-bytes 65536 --max-lines 500 input.json output.md
+  python chat_to_markdown.py --shard-requests 100 input.json output.md
+  python chat_to_markdown.py batch exports/ --output-dir markdown/ --jobs 16
+        """
+    )
+    parser.add_argument('input_file', help="Input JSON file (chat log, optionally .gz/.bz2/.xz), or '-' for stdin")
+    parser.add_argument('output_file', help="Output markdown file (compressed if it ends in .gz/.bz2/.xz), or '-' for stdout")
+    parser.add_argument('--stream', action='store_true', help='Decode one request at a time to bound memory use')
+    parser.add_argument('--incremental', action='store_true', help='Only render requests that are new or changed since the last --incremental run')
+    parser.add_argument('--profile', action='store_true', help='Print per-stage timings and peak memory to stderr. Only the main process is profiled: with -j, rendering done by the workers is not broken down by stage. Not thread-safe when used from Python (see Profiler)')
+    parser.add_argument('--profile-format', choices=['table', 'json'], default='table', help='Format of the --profile report (default: table)')
+    parser.add_argument('--shard-requests', type=int, metavar='N', help='Split the output into files of N requests, with the Table of Contents in the output file')
+    parser.add_argument('--shard-bytes', type=int, metavar='N', help='Split the output into files of at most about N bytes each')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes that render requests (default: 1, or CPU count with --shard-requests)')
+    add_render_arguments(parser)
+    add_cache_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    options = render_options_from_args(parser, args)
+    cache = cache_from_args(parser, args)
+    if args.shard_requests is not None and args.shard_bytes is not None:
+        parser.error('--shard-requests and --shard-bytes are mutually exclusive')
+    for name in ('shard_requests', 'shard_bytes', 'jobs'):
+        value = getattr(args, name)
+        if value is not None and value < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    if (args.shard_requests or args.shard_bytes) and (args.incremental or args.output_file == STDIO_PATH or
+                                                      compression_for(args.output_file)):
+        parser.error('sharded output needs an uncompressed output file and can\'t be combined with --incremental')
+    if args.dedupe and args.shard_bytes:
+        parser.error('--dedupe can\'t be combined with --shard-bytes')
+    conversion = {'stream': args.stream, 'incremental': args.incremental, 'options': options,
+                  'shard_requests': args.shard_requests, 'shard_bytes': args.shard_bytes, 'jobs': args.jobs,
+                  'cache': cache}
+    
+    try:
+        if args.profile:
+            with Profiler() as profiler:
+                convert_file(args.input_file, args.output_file, **conversion)
+            if args.profile_format == 'json':
+                print(json.dumps(profiler.report(), indent=2), file=sys.stderr)
+            else:
+                print(profiler.format_table(), file=sys.stderr)
+        else:
+            convert_file(args.input_file, args.output_file, **conversion)
+        # Keep stdout clean when the markdown itself goes there
+        status = sys.stderr if args.output_file == STDIO_PATH else sys.stdout
+        print(f"Successfully converted {args.input_file} to {args.output_file}", file=status)
+    except Exception as e:
+        print(f"Error: {describe_error(args.input_file, e)}", file=sys.stderr)
+        sys.exit(1)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()